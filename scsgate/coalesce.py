@@ -0,0 +1,72 @@
+""" This module contains the definition of the StateCoalescer class.
+This one reduces the number of state messages delivered while roller
+shutters and dimmers are moving """
+
+import time
+
+from scsgate.messages import StateMessage
+
+
+class StateCoalescer:
+    """ Holds the state messages of each entity for a time window and
+    delivers only the last one received. The other messages are
+    delivered right away """
+
+    def __init__(self, handle_message, window=0.5, clock=time.monotonic):
+        """ Initialize the instance
+
+        Arguments:
+        handle_message: callback function to invoke with the messages
+        window: seconds the first state message of an entity is held,
+            the latest state received in the meantime replaces it
+        clock: function returning the current time in seconds
+        """
+        self._handle_message = handle_message
+        self._window = window
+        self._clock = clock
+        # entity ID -> last state message received
+        self._pending = {}
+        # entity ID -> time at which its state has to be delivered
+        self._deadlines = {}
+        self._coalesced = 0
+
+    @property
+    def coalesced(self):
+        """ Number of state messages replaced by a newer one """
+        return self._coalesced
+
+    def handle_message(self, message, now=None):
+        """ Receives a message from the bus """
+        if not isinstance(message, StateMessage):
+            self._handle_message(message)
+            return
+
+        entity = message.entity
+        if entity in self._pending:
+            self._coalesced += 1
+        else:
+            if now is None:
+                now = self._clock()
+            self._deadlines[entity] = now + self._window
+        self._pending[entity] = message
+
+    def flush(self, now=None):
+        """ Delivers the states whose window is over """
+        if not self._deadlines:
+            return
+        if now is None:
+            now = self._clock()
+
+        expired = [entity for entity, deadline in self._deadlines.items()
+                   if deadline <= now]
+        for entity in expired:
+            del self._deadlines[entity]
+            self._handle_message(self._pending.pop(entity))
+
+    def flush_all(self):
+        """ Delivers all the held states """
+        pending = self._pending
+        self._pending = {}
+        self._deadlines = {}
+        for message in pending.values():
+            self._handle_message(message)
@@ -0,0 +1,210 @@
+""" This module contains the definition of the CommandVerifier class.
+This one confirms the commands sent through scsgate.Reactor by
+watching the state messages the devices emit once they switched.
+
+An acknowledgement of SCSGate only means the command has been accepted,
+not that the device executed it. Instead of following every command
+with a status request, the verifier waits for the state message of the
+device; only when it does not arrive before the deadline the device is
+probed with a status request and, if its state is still wrong, the
+command is sent again.
+"""
+
+import threading
+
+from scsgate.messages import StateMessage
+from scsgate.tasks import BasicTask, GetStatusTask, ToggleStatusTask
+
+
+class PendingCommand:
+    """ A command waiting for its confirmation """
+
+    def __init__(self, task):
+        self._task = task
+        self._expected = None
+        if isinstance(task, ToggleStatusTask):
+            self._expected = "on" if task.toggled else "off"
+        self._done = threading.Event()
+        self._confirmed = False
+        self.attempts = 1
+        self.probing = False
+        # set once the command has been sent: state messages received
+        # before that cannot confirm it
+        self.sent = False
+
+    @property
+    def task(self):
+        """ The command """
+        return self._task
+
+    @property
+    def done(self):
+        """ True once the command has been confirmed or given up """
+        return self._done.is_set()
+
+    @property
+    def confirmed(self):
+        """ True if the device reported the expected state """
+        return self._confirmed
+
+    def matches(self, message):
+        """ True if the state message confirms the command. Any state
+        confirms commands without an expected status, like the roller
+        shutter ones """
+        return self._expected is None or message.status == self._expected
+
+    def complete(self, confirmed):
+        """ Marks the command as confirmed or failed """
+        self._confirmed = confirmed
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """ Waits for the outcome, returns True if the command has been
+        confirmed """
+        self._done.wait(timeout)
+        return self._confirmed
+
+    def __str__(self):
+        return "PendingCommand: {}".format(self._task)
+
+
+class _CommandTask(BasicTask):
+    """ Executes a command and arms the deadline of its confirmation """
+
+    def __init__(self, verifier, pending):
+        self._verifier = verifier
+        self._pending = pending
+
+    def execute(self, connection):
+        self._pending.probing = False
+        self._pending.sent = True
+        self._verifier._arm(self._pending)
+        self._pending.task.execute(connection)
+
+    def __str__(self):
+        return "Confirmed {}".format(self._pending.task)
+
+
+class _ProbeTask(GetStatusTask):
+    """ Requests the status of a device whose command is not confirmed """
+
+    def __init__(self, verifier, pending):
+        GetStatusTask.__init__(self, target=pending.task.target)
+        self._verifier = verifier
+        self._pending = pending
+
+    def execute(self, connection):
+        self._pending.probing = True
+        self._verifier._arm(self._pending)
+        GetStatusTask.execute(self, connection)
+
+
+class _DeadlineTask(BasicTask):
+    """ Runs in the reactor thread when the deadline of a command expires,
+    does not talk to SCSGate by itself """
+
+    # no command is sent to the bus
+    cost = 0
+
+    def __init__(self, verifier, pending, attempt, probing):
+        self._verifier = verifier
+        self._pending = pending
+        self._attempt = attempt
+        self._probing = probing
+
+    def execute(self, connection):
+        pending = self._pending
+        # a newer deadline has been armed in the meantime
+        if pending.done or pending.attempts != self._attempt or \
+           pending.probing != self._probing:
+            return
+        if not pending.probing:
+            self._verifier._probe(pending)
+        else:
+            self._verifier._retry(pending)
+
+    def __str__(self):
+        return "Deadline of {}".format(self._pending.task)
+
+
+class CommandVerifier:
+    """ Sends commands through a scsgate.Reactor and confirms them with
+    the state messages emitted by the devices """
+
+    def __init__(self, reactor, deadline=1.0, retries=1):
+        """ Initialize the instance
+
+        Arguments:
+        reactor: the scsgate.Reactor
+        deadline: seconds to wait for the state message of the device
+            before probing it, and then for the answer to the probe
+        retries: number of times a command is sent again when the device
+            is not in the expected state
+        """
+        self._reactor = reactor
+        self._deadline = deadline
+        self._retries = retries
+        # entity ID -> PendingCommand
+        self._pending = {}
+        self._lock = threading.Lock()
+        reactor.add_listener(self.handle_message)
+
+    def close(self):
+        """ Stops watching the messages of the reactor """
+        self._reactor.remove_listener(self.handle_message)
+
+    def submit(self, task):
+        """ Queues a SetStatusTask and returns a PendingCommand to wait for
+        its confirmation. A pending command for the same device is
+        superseded, and reported as not confirmed """
+        pending = PendingCommand(task)
+        with self._lock:
+            previous = self._pending.get(task.target)
+            self._pending[task.target] = pending
+        if previous is not None:
+            previous.complete(False)
+        self._reactor.append_task(_CommandTask(self, pending))
+        return pending
+
+    def handle_message(self, message):
+        """ Listener of the reactor, completes the commands confirmed by
+        the state messages """
+        if not isinstance(message, StateMessage):
+            return
+        with self._lock:
+            pending = self._pending.get(message.entity)
+        if pending is None or pending.done or not pending.sent:
+            return
+
+        if pending.matches(message):
+            self._finish(pending, True)
+        elif pending.probing:
+            # the device answered the probe with the wrong state
+            self._retry(pending)
+
+    def _arm(self, pending):
+        """ Schedules the check of the deadline of the current attempt """
+        self._reactor.schedule_task(
+            _DeadlineTask(self, pending, pending.attempts, pending.probing),
+            self._deadline)
+
+    def _probe(self, pending):
+        """ Asks the device for its state """
+        self._reactor.append_task(_ProbeTask(self, pending))
+
+    def _retry(self, pending):
+        """ Sends the command again, gives up when there are no retries
+        left """
+        if pending.attempts > self._retries:
+            self._finish(pending, False)
+            return
+        pending.attempts += 1
+        pending.probing = False
+        self._reactor.append_task(_CommandTask(self, pending))
+
+    def _finish(self, pending, confirmed):
+        """ Completes a pending command """
+        with self._lock:
+            if self._pending.get(pending.task.target) is pending:
+                del self._pending[pending.task.target]
+        pending.complete(confirmed)
@@ -3,51 +3,70 @@ with the SCSGate device """
 
 import serial as pyserial
 
+from scsgate.reader import BufferedReader, ReadTimeout
+
 
 class Connection:
     """ Connection to SCSGate device """
 
-    def __init__(self, device, logger):
+    def __init__(self, device, logger, timeout=0.05, read_timeout=5.0):
         """ Initialize the class
 
         Arguments:
         device: string containing the serial device allocated to SCSGate
         logger: instance of logging
+        timeout: timeout of the single reads from the serial port, the
+            reader checks the deadline of its operations at this interval
+        read_timeout: default time SCSGate has to answer, None waits
+            forever
         """
-        self._serial = pyserial.Serial(device, 115200)
+        self._serial = pyserial.Serial(device, 115200, timeout=timeout)
+        self._reader = BufferedReader(self._serial, timeout=read_timeout)
 
         logger.info("Clearing buffers")
-        self._serial.write(b"@b")
-        ret = self._serial.read(1)
-        if ret != b"k":
-            raise RuntimeError("Error while clearing buffers")
+        self._command(b"@b", "Error while clearing buffers")
 
         # ensure pending operations are terminated (eg: @r, @l)
-        self._serial.write(b"@c")
-        ret = self._serial.read()
-        if ret != b"k":
-            raise RuntimeError("Error while cancelling pending operations")
+        self._command(b"@c", "Error while cancelling pending operations")
 
         logger.info("Enabling ASCII mode")
-        self._serial.write(b"@MA")
-        ret = self._serial.read(1)
-        if ret != b"k":
-            raise RuntimeError("Error while enabling ASCII mode")
+        self._command(b"@MA", "Error while enabling ASCII mode")
 
         logger.info("Filter Ack messages")
-        self._serial.write(b"@F2")
-        ret = self._serial.read(1)
-        if ret != b"k":
-            raise RuntimeError("Error while setting filter")
+        self._command(b"@F2", "Error while setting filter")
 
     @property
     def serial(self):
         """ Returns the pyserial.Serial instance """
         return self._serial
 
-    def close(self):
+    @property
+    def reader(self):
+        """ Returns the scsgate.reader.BufferedReader reading from the
+        serial port """
+        return self._reader
+
+    def close(self, timeout=0.5):
         """ Closes the connection to the serial port and ensure no pending
-        operatoin are left """
+        operatoin are left
+
+        Arguments:
+        timeout: seconds SCSGate has to acknowledge the cancellation of
+            the pending operations, the port is closed anyway
+        """
         self._serial.write(b"@c")
-        self._serial.read()
+        try:
+            self._reader.read(1, timeout=timeout)
+        except ReadTimeout:
+            pass
         self._serial.close()
+
+    def _command(self, command, error):
+        """ Sends a command, raises RuntimeError if it's not acknowledged """
+        self._serial.write(command)
+        try:
+            ret = self._reader.read(1)
+        except ReadTimeout:
+            ret = None
+        if ret != b"k":
+            raise RuntimeError(error)
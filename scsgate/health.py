@@ -0,0 +1,192 @@
+""" This module contains the definition of the HealthMonitor class.
+This one tracks the latencies of scsgate.Reactor and detects a wedged
+gateway """
+
+import collections
+import threading
+import time
+
+from scsgate.reader import ReadCancelled, ReadTimeout
+from scsgate.tasks import BasicTask, ExecutionError
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """ Returns a dict with the requested percentiles of the samples,
+    computed with the nearest-rank method. Empty when there are no
+    samples """
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    result = {}
+    for point in points:
+        rank = max(1, -(-point * len(ordered) // 100))
+        result["p{}".format(point)] = ordered[rank - 1]
+    return result
+
+
+class PingTask(BasicTask):
+    """ Sends a harmless command to SCSGate and measures how long it takes
+    to be acknowledged """
+
+    def __init__(self, health, command=b"@MA"):
+        """ Initialize the instance
+
+        Arguments:
+        health: the HealthMonitor receiving the round-trip time
+        command: command to send, by default the one enabling the ASCII
+            mode, which is already enabled by scsgate.Connection
+        """
+        self._health = health
+        self._command = command
+
+    def execute(self, connection):
+        clock = self._health.clock
+        start = clock()
+        connection.serial.write(self._command)
+        try:
+            ret = connection.reader.read(1)
+        except ReadCancelled:
+            # the reactor is stopping, the gateway is not to blame
+            raise
+        except ReadTimeout:
+            # a wedged gateway does not answer at all
+            self._health.record_ping_failure()
+            raise
+        if ret != b'k':
+            self._health.record_ping_failure()
+            raise ExecutionError(
+                "Error while pinging SCSGate. Command {}, got {}".format(
+                    self._command, ret))
+        self._health.record_ping(clock() - start)
+
+    def __str__(self):
+        return "PingTask"
+
+
+class HealthMonitor:
+    """ Collects the latencies of a scsgate.Reactor and tells whether the
+    gateway is alive and ready.
+
+    The gateway is live while the reactor loop keeps iterating, it is
+    ready when it is live and the last ping has been acknowledged within
+    the expected latency """
+
+    def __init__(self, ping_interval=30.0, liveness_timeout=10.0,
+                 max_ping_latency=0.5, samples=256, clock=time.monotonic):
+        """ Initialize the instance
+
+        Arguments:
+        ping_interval: seconds between two pings
+        liveness_timeout: the gateway is considered wedged when the
+            reactor loop does not iterate for this many seconds
+        max_ping_latency: seconds, slower pings make the gateway not
+            ready
+        samples: number of samples kept to compute the percentiles
+        clock: function returning the current time in seconds, the one
+            of the scsgate.Reactor feeding the monitor
+        """
+        self._ping_interval = ping_interval
+        self._liveness_timeout = liveness_timeout
+        self._max_ping_latency = max_ping_latency
+
+        self._ping_times = collections.deque(maxlen=samples)
+        self._poll_times = collections.deque(maxlen=samples)
+        self._message_gaps = collections.deque(maxlen=samples)
+
+        self._clock = clock
+        self._last_heartbeat = clock()
+        self._last_message = None
+        self._last_ping = None
+        self._last_ping_ok = False
+        self._ping_failures = 0
+
+        self._terminate = threading.Event()
+        self._thread = None
+
+    @property
+    def clock(self):
+        """ The function returning the current time """
+        return self._clock
+
+    def start(self, reactor):
+        """ Starts a thread queuing a PingTask on the reactor every
+        ping_interval seconds """
+        def ping_loop():
+            while True:
+                reactor.append_task(PingTask(self))
+                if self._terminate.wait(self._ping_interval):
+                    return
+
+        self._thread = threading.Thread(target=ping_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the ping thread """
+        self._terminate.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def heartbeat(self, now=None):
+        """ Invoked by the reactor at every iteration of its loop """
+        self._last_heartbeat = now if now is not None else self._clock()
+
+    def record_poll(self, duration):
+        """ Records the duration of a @r poll cycle """
+        self._poll_times.append(duration)
+
+    def record_message(self, now=None):
+        """ Records the arrival of a message from the bus """
+        if now is None:
+            now = self._clock()
+        if self._last_message is not None:
+            self._message_gaps.append(now - self._last_message)
+        self._last_message = now
+
+    def record_ping(self, latency, now=None):
+        """ Records the round-trip time of a ping """
+        self._ping_times.append(latency)
+        self._last_ping = now if now is not None else self._clock()
+        self._last_ping_ok = latency <= self._max_ping_latency
+
+    def record_ping_failure(self, now=None):
+        """ Records a ping refused by the gateway """
+        self._ping_failures += 1
+        self._last_ping = now if now is not None else self._clock()
+        self._last_ping_ok = False
+
+    def live(self, now=None):
+        """ False when the reactor loop is stuck, eg: blocked on a serial
+        read which never returns """
+        if now is None:
+            now = self._clock()
+        return now - self._last_heartbeat < self._liveness_timeout
+
+    def ready(self, now=None):
+        """ True when the gateway is live and acknowledged the last ping in
+        time. A ping older than two intervals is not trusted """
+        if now is None:
+            now = self._clock()
+        if not self.live(now) or self._last_ping is None:
+            return False
+        if now - self._last_ping > 2 * self._ping_interval:
+            return False
+        return self._last_ping_ok
+
+    def status(self, now=None):
+        """ Returns a dict describing the health of the gateway """
+        if now is None:
+            now = self._clock()
+        silence = None
+        if self._last_message is not None:
+            silence = now - self._last_message
+        return {
+            "live": self.live(now),
+            "ready": self.ready(now),
+            "since_heartbeat": now - self._last_heartbeat,
+            "since_last_message": silence,
+            "ping_failures": self._ping_failures,
+            "ping": percentiles(self._ping_times),
+            "poll": percentiles(self._poll_times),
+            "message_gap": percentiles(self._message_gaps),
+        }
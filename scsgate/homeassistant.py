@@ -0,0 +1,297 @@
+""" This module contains the definition of the HomeAssistantConfig class,
+the configuration of home assistant generated by scs-monitor.
+
+The configuration is saved while the devices are discovered, not only on
+exit: changes are collected for a short delay and then written to a
+temporary file renamed over the old one, so the file is never left half
+written. The existing file is merged, not replaced.
+
+Besides the "devices" section read by scs-monitor and scsgate.Reactor,
+the devices are listed in the section of the home assistant platform
+matching the messages they sent:
+
+    devices:
+      kitchen:
+        name: Kitchen
+        scs_id: '33'
+    light:
+    - platform: scsgate
+      devices:
+        kitchen:
+          name: Kitchen
+          scs_id: '33'
+
+Every section is serialized again only when it changes. The tags of
+home assistant, such as ``!secret`` and ``!include``, are written back
+as they were read.
+"""
+
+import os
+import time
+
+import yaml
+
+from scsgate.messages import (
+    CommandMessage, ScenarioTriggeredMessage, StateMessage)
+
+
+class TaggedValue:
+    """ A value carrying a local YAML tag, like ``!secret db_password``.
+    Home assistant resolves these tags itself, they are kept as they are """
+
+    def __init__(self, tag, value):
+        self.tag = tag
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, TaggedValue) and \
+            (self.tag, self.value) == (other.tag, other.value)
+
+    def __repr__(self):
+        return "TaggedValue({!r}, {!r})".format(self.tag, self.value)
+
+
+class YamlLoader(getattr(yaml, "CSafeLoader", yaml.SafeLoader)):
+    """ Safe YAML loader which keeps the local tags as TaggedValue """
+
+
+class YamlDumper(getattr(yaml, "CSafeDumper", yaml.SafeDumper)):
+    """ Safe YAML dumper which writes TaggedValue back with its tag """
+
+
+def _construct_tagged(loader, tag, node):
+    """ Builds the TaggedValue of a node with a local tag """
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+    return TaggedValue("!" + tag, value)
+
+
+def _represent_tagged(dumper, tagged):
+    """ Serializes a TaggedValue with its tag """
+    if isinstance(tagged.value, list):
+        return dumper.represent_sequence(tagged.tag, tagged.value)
+    if isinstance(tagged.value, dict):
+        return dumper.represent_mapping(tagged.tag, tagged.value)
+    return dumper.represent_scalar(tagged.tag, tagged.value)
+
+
+YamlLoader.add_multi_constructor("!", _construct_tagged)
+YamlDumper.add_representer(TaggedValue, _represent_tagged)
+
+# Kind of device -> section of the home assistant configuration. Scenario
+# switches are handled by the switch platform, which fires an event when
+# they are pressed
+PLATFORMS = {
+    "light": "light",
+    "cover": "cover",
+    "scenario": "switch",
+}
+
+# A device which sent messages of many kinds is assigned to the most
+# specific one
+_PRIORITY = {"light": 0, "cover": 1, "scenario": 2}
+
+# Actions of the commands sent to roller shutters: raise, lower and halt
+_COVER_ACTIONS = ("08", "09", "0A")
+
+
+def device_kind(message):
+    """ Returns the kind of device suggested by a message, None when the
+    message says nothing about it """
+    if isinstance(message, ScenarioTriggeredMessage):
+        return "scenario"
+    if isinstance(message, CommandMessage) and \
+       message.bytes[4] in _COVER_ACTIONS:
+        return "cover"
+    if isinstance(message, (StateMessage, CommandMessage)):
+        return "light"
+    return None
+
+
+class HomeAssistantConfig:
+    """ Keeps the configuration file of home assistant up to date with
+    the devices discovered on the bus """
+
+    def __init__(self, path, delay=1.0, max_delay=10.0,
+                 clock=time.monotonic):
+        """ Initialize the instance, loading the existing file
+
+        Arguments:
+        path: the configuration file
+        delay: seconds without changes after which the file is written
+        max_delay: seconds after which pending changes are written even
+            if new ones keep arriving
+        clock: function returning the current time in seconds
+        """
+        self._path = path
+        self._delay = delay
+        self._max_delay = max_delay
+        self._clock = clock
+
+        self._document = {}
+        if os.path.isfile(path):
+            with open(path, "r") as conf:
+                try:
+                    self._document = yaml.load(conf, Loader=YamlLoader) or {}
+                except yaml.YAMLError as err:
+                    raise ValueError("Cannot parse {}: {}".format(path, err))
+        if not isinstance(self._document, dict):
+            raise ValueError("{} is not a YAML mapping".format(path))
+        self._devices = self._document.setdefault("devices", {}) or {}
+        if not isinstance(self._devices, dict):
+            raise ValueError(
+                "The devices section of {} must be a mapping".format(path))
+        self._document["devices"] = self._devices
+
+        # entity ID -> kind of device
+        self._kinds = {}
+        # entity ID -> home assistant ID
+        self._ha_ids = {}
+        for ha_id, device in self._devices.items():
+            self._ha_ids[str(device["scs_id"])] = ha_id
+        for kind, section in PLATFORMS.items():
+            devices = self._platform_devices(section, create=False)
+            for device in devices.values():
+                self._kinds[str(device["scs_id"])] = kind
+
+        # section -> serialized YAML, None when it has to be rendered
+        self._rendered = dict.fromkeys(self._document)
+        self._first_change = None
+        self._due = None
+        self._writes = 0
+
+    @property
+    def writes(self):
+        """ Number of times the file has been written """
+        return self._writes
+
+    @property
+    def dirty(self):
+        """ True if some changes have not been written yet """
+        return self._due is not None
+
+    def devices(self):
+        """ Yields a (entity ID, home assistant ID, name) tuple for each
+        device of the configuration """
+        for ha_id, device in self._devices.items():
+            yield str(device["scs_id"]), ha_id, device.get("name")
+
+    def kind(self, entity):
+        """ Returns the kind of device observed for the entity, None if
+        not known yet """
+        return self._kinds.get(entity)
+
+    def observe(self, message):
+        """ Learns the kind of device from a message of the bus. A known
+        device is moved to the section of its new platform, when needed """
+        kind = device_kind(message)
+        entity = message.entity
+        if kind is None or entity is None:
+            return
+        previous = self._kinds.get(entity)
+        if previous is not None and \
+           _PRIORITY[previous] >= _PRIORITY[kind]:
+            return
+
+        self._kinds[entity] = kind
+        ha_id = self._ha_ids.get(entity)
+        if ha_id is None:
+            return
+        if previous is not None:
+            section = PLATFORMS[previous]
+            self._platform_devices(section).pop(ha_id, None)
+            self._touch(section)
+        self._platform_devices(PLATFORMS[kind])[ha_id] = \
+            dict(self._devices[ha_id])
+        self._touch(PLATFORMS[kind])
+
+    def add_device(self, entity, ha_id, name):
+        """ Adds a device to the configuration, and to the section of its
+        platform when its kind is known """
+        device = {"name": name, "scs_id": entity}
+        self._devices[ha_id] = device
+        self._ha_ids[entity] = ha_id
+        self._touch("devices")
+
+        kind = self._kinds.get(entity)
+        if kind is not None:
+            self._platform_devices(PLATFORMS[kind])[ha_id] = dict(device)
+            self._touch(PLATFORMS[kind])
+
+    def flush(self, now=None):
+        """ Writes the file if the changes have settled. Returns True if
+        the file has been written """
+        if self._due is None:
+            return False
+        if now is None:
+            now = self._clock()
+        if now < self._due:
+            return False
+        self.save()
+        return True
+
+    def save(self):
+        """ Writes the pending changes right away """
+        if self._due is None:
+            return
+        for section, text in self._rendered.items():
+            if text is None:
+                self._rendered[section] = yaml.dump(
+                    {section: self._document[section]},
+                    Dumper=YamlDumper,
+                    default_flow_style=False,
+                    sort_keys=False)
+
+        temporary = self._path + ".tmp"
+        with open(temporary, "w") as conf:
+            conf.write("".join(self._rendered.values()))
+            conf.flush()
+            os.fsync(conf.fileno())
+        os.replace(temporary, self._path)
+
+        self._writes += 1
+        self._first_change = None
+        self._due = None
+
+    def _platform_devices(self, section, create=True):
+        """ Returns the devices of the scsgate entry of a platform section.
+        The entry is created when missing, unless create is False; the
+        entries of the other platforms are left untouched. Sections and
+        entries kept in other files, like ``light: !include lights.yaml``,
+        are not modified: an empty dict is returned """
+        entries = self._document.get(section)
+        if entries is None:
+            if not create:
+                return {}
+            entries = self._document[section] = []
+        elif not isinstance(entries, list):
+            return {}
+        for entry in entries:
+            if isinstance(entry, dict) and entry.get("platform") == "scsgate":
+                break
+        else:
+            if not create:
+                return {}
+            entry = {"platform": "scsgate"}
+            entries.append(entry)
+        devices = entry.get("devices")
+        if devices is None:
+            if not create:
+                return {}
+            devices = entry["devices"] = {}
+        elif not isinstance(devices, dict):
+            return {}
+        return devices
+
+    def _touch(self, section):
+        """ Marks a section as changed and postpones the write """
+        self._rendered[section] = None
+        now = self._clock()
+        if self._first_change is None:
+            self._first_change = now
+        self._due = min(now + self._delay,
+                        self._first_change + self._max_delay)
@@ -0,0 +1,272 @@
+""" This module contains the definition of the TaskJournal class.
+This one persists the tasks queued on scsgate.Reactor, so that the
+commands not executed yet survive a crash or a restart.
+
+The journal is an append-only file of JSON lines. Every queued task adds
+an "add" record, every completed one a "done" record:
+
+    {"op": "add", "id": 4, "time": 1700000000.5,
+     "task": {"type": "ToggleStatusTask", "target": "33", "toggled": true}}
+    {"op": "done", "id": 4}
+
+Records are written by a background thread: the ones queued while the
+file is being synced are written together and synced once (group
+commit), so queuing a task never waits for the disk. Once enough
+records are obsolete the file is rewritten with the pending tasks only,
+and atomically renamed over the old one.
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from scsgate.tasks import (
+    GetStatusTask, HaltRollerShutterTask, LowerRollerShutterTask,
+    RaiseRollerShutterTask, SetStatusTask, ToggleStatusTask)
+
+# Task class -> function returning the arguments needed to build it
+# again, besides the target
+TASK_TYPES = {
+    ToggleStatusTask: lambda task: {"toggled": task.toggled},
+    RaiseRollerShutterTask: lambda task: {},
+    LowerRollerShutterTask: lambda task: {},
+    HaltRollerShutterTask: lambda task: {},
+    SetStatusTask: lambda task: {"action": task.action},
+    GetStatusTask: lambda task: {},
+}
+
+_TASK_CLASSES = {cls.__name__: cls for cls in TASK_TYPES}
+
+
+def describe_task(task):
+    """ Returns the JSON serializable descriptor of a task, None if the
+    task cannot be journaled. Subclasses are not journaled: they may
+    carry state which cannot be restored """
+    arguments = TASK_TYPES.get(type(task))
+    if arguments is None:
+        return None
+    descriptor = {"type": type(task).__name__, "target": task.target}
+    descriptor.update(arguments(task))
+    return descriptor
+
+
+def build_task(descriptor):
+    """ Creates the task described by describe_task. Raises ValueError
+    if the descriptor is not valid """
+    arguments = dict(descriptor)
+    try:
+        cls = _TASK_CLASSES[arguments.pop("type")]
+        return cls(**arguments)
+    except (KeyError, TypeError) as err:
+        raise ValueError("Invalid task descriptor {}: {}".format(
+            descriptor, err))
+
+
+class TaskJournal:
+    """ Durable log of the tasks queued on a scsgate.Reactor """
+
+    def __init__(self, path, max_age=300.0, compact_threshold=1000,
+                 clock=time.time, logger=None):
+        """ Initialize the instance, loading the tasks left pending by the
+        previous run
+
+        Arguments:
+        path: the journal file, created when missing
+        max_age: seconds after which a pending task is considered stale
+            and not replayed, None to replay all of them
+        compact_threshold: number of obsolete records which triggers the
+            rewrite of the file
+        clock: function returning the wall clock time, the journal is
+            read by other processes
+        logger: instance of logger, by default the one of this module
+        """
+        self._path = path
+        self._max_age = max_age
+        self._compact_threshold = compact_threshold
+        self._clock = clock
+        self._logger = logger or logging.getLogger(__name__)
+
+        # entry ID -> (time, task), in order of insertion
+        self._pending = collections.OrderedDict()
+        # id of a pending task -> its entry IDs, in order: the same task
+        # object may be queued more than once
+        self._entries = {}
+        self._next_id = 0
+        # records written but not synced yet
+        self._lines = []
+        # number of obsolete records in the file
+        self._garbage = 0
+        # sequence numbers of the last record queued and synced
+        self._queued = 0
+        self._synced = 0
+        self._syncs = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+        self._load()
+        self._rewrite(list(self._pending.items()))
+        self._file = open(self._path, "a")
+
+        self._thread = threading.Thread(target=self._write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def syncs(self):
+        """ Number of times the file has been synced to disk """
+        return self._syncs
+
+    def pending(self):
+        """ Returns the tasks not completed yet, in order of insertion.
+        Right after the creation of the journal these are the ones left
+        by the previous run """
+        with self._condition:
+            return [task for _, task in self._pending.values()]
+
+    def append(self, task):
+        """ Records a queued task. Returns False if the task cannot be
+        journaled. Does not wait for the disk """
+        descriptor = describe_task(task)
+        if descriptor is None:
+            return False
+        with self._condition:
+            entry = self._next_id
+            self._next_id += 1
+            now = self._clock()
+            self._pending[entry] = (now, task)
+            self._entries.setdefault(id(task), collections.deque()).append(
+                entry)
+            self._queue({"op": "add", "id": entry, "time": now,
+                         "task": descriptor})
+        return True
+
+    def complete(self, task):
+        """ Records that a task has been executed, or given up. Tasks which
+        are not journaled are ignored """
+        with self._condition:
+            entries = self._entries.get(id(task))
+            if entries is None:
+                return
+            entry = entries.popleft()
+            if not entries:
+                del self._entries[id(task)]
+            del self._pending[entry]
+            self._garbage += 2
+            self._queue({"op": "done", "id": entry})
+
+    def sync(self, timeout=None):
+        """ Waits until the records queued so far are on disk. Returns
+        False if the timeout expired """
+        with self._condition:
+            target = self._queued
+            return self._condition.wait_for(
+                lambda: self._synced >= target or self._closed, timeout)
+
+    def close(self):
+        """ Writes the pending records and stops the writer thread """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._file.close()
+
+    def _queue(self, record):
+        """ Hands a record to the writer thread. Must be invoked with the
+        lock held """
+        if self._closed:
+            return
+        self._lines.append(json.dumps(record, separators=(",", ":")))
+        self._queued += 1
+        self._condition.notify_all()
+
+    def _write_loop(self):
+        """ Body of the writer thread: every batch of records is written
+        with a single sync """
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._lines or self._closed)
+                lines = self._lines
+                self._lines = []
+                batch_end = self._queued
+                snapshot = None
+                if self._garbage >= self._compact_threshold:
+                    # the snapshot already contains the effect of lines
+                    snapshot = list(self._pending.items())
+                    self._garbage = 0
+                closed = self._closed
+
+            try:
+                if snapshot is not None:
+                    self._file.close()
+                    self._rewrite(snapshot)
+                    self._file = open(self._path, "a")
+                elif lines:
+                    self._file.write("\n".join(lines) + "\n")
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+            except OSError as err:
+                self._logger.error(
+                    "scsgate.TaskJournal: cannot write %s: %s",
+                    self._path, err)
+
+            with self._condition:
+                self._synced = batch_end
+                self._syncs += 1
+                self._condition.notify_all()
+            if closed and not lines:
+                return
+
+    def _load(self):
+        """ Reads the journal left by the previous run """
+        try:
+            handle = open(self._path)
+        except FileNotFoundError:
+            return
+
+        records = {}
+        with handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                    entry = record["id"]
+                    if record["op"] == "add":
+                        records[entry] = (
+                            record["time"], build_task(record["task"]))
+                    else:
+                        records.pop(entry, None)
+                except (ValueError, KeyError, TypeError):
+                    # a record cut by a crash, or written by a newer
+                    # version
+                    self._logger.warning(
+                        "scsgate.TaskJournal: skipping record %r", line)
+                    continue
+                self._next_id = max(self._next_id, entry + 1)
+
+        now = self._clock()
+        for entry in sorted(records):
+            queued_at, task = records[entry]
+            if self._max_age is not None and \
+               now - queued_at > self._max_age:
+                self._logger.info(
+                    "scsgate.TaskJournal: dropping stale %s", task)
+                continue
+            self._pending[entry] = (queued_at, task)
+            self._entries[id(task)] = collections.deque([entry])
+
+    def _rewrite(self, entries):
+        """ Replaces the file with one containing only the given pending
+        entries """
+        temporary = self._path + ".tmp"
+        with open(temporary, "w") as handle:
+            for entry, (queued_at, task) in entries:
+                handle.write(json.dumps(
+                    {"op": "add", "id": entry, "time": queued_at,
+                     "task": describe_task(task)},
+                    separators=(",", ":")) + "\n")
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, self._path)
@@ -0,0 +1,113 @@
+""" This module contains helpers to log the traffic of the bus without
+slowing down the threads talking to SCSGate.
+
+Records are formatted lazily: nothing is built when the level is
+disabled, and with setup_async_logging the formatting and the writes
+happen in a separate thread.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+
+
+class LazyJoin:
+    """ Joins the items only when the log record is formatted """
+
+    __slots__ = ("_items", "_separator")
+
+    def __init__(self, items, separator=" "):
+        self._items = items
+        self._separator = separator
+
+    def __str__(self):
+        return self._separator.join(self._items)
+
+
+def log_event(logger, level, event, **fields):
+    """ Logs a structured event made by a name and some fields. Nothing is
+    done when the level is disabled for the logger """
+    if logger.isEnabledFor(level):
+        logger.log(level, "%s", event,
+                   extra={"event": event, "fields": fields})
+
+
+class StructuredFormatter(logging.Formatter):
+    """ Text formatter appending the fields of the structured events to
+    the message, as key=value pairs """
+
+    def formatMessage(self, record):
+        message = logging.Formatter.formatMessage(self, record)
+        fields = getattr(record, "fields", None)
+        if not fields:
+            return message
+        return message + " " + " ".join(
+            "{}={}".format(key, value) for key, value in fields.items())
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """ Formats each record as a JSON document on a single line """
+
+    def format(self, record):
+        document = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None) or record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            document.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            document["exception"] = record.exc_text
+        return json.dumps(document, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """ Queue handler leaving the formatting of the records to the
+    listener thread. The arguments of the records must not be changed
+    after they have been logged """
+
+    def prepare(self, record):
+        if record.exc_info:
+            # tracebacks cannot be sent to another thread safely
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_async_logging(filename=None, formatter=None, level=logging.DEBUG,
+                        logger=None):
+    """ Sends the records of a logger to a file, or to stderr, through a
+    queue served by a background thread.
+
+        filename: file the records are appended to, stderr when None
+        formatter: the logging.Formatter to use, by default a
+            StructuredFormatter
+        level: level of the logger
+        logger: the logger to configure, the root one by default
+
+        returns: the started logging.handlers.QueueListener, stop it
+            before exiting to write the pending records
+    """
+    if filename:
+        handler = logging.FileHandler(filename, mode="a")
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(
+        formatter or StructuredFormatter('%(asctime)s : %(message)s'))
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+
+    if logger is None:
+        logger = logging.getLogger()
+    logger.addHandler(_DeferredQueueHandler(records))
+    logger.setLevel(level)
+
+    listener.start()
+    return listener
@@ -24,6 +24,13 @@ class SCSMessage:
         """ The ID of the subject of this message """
         return None
 
+    def as_dict(self):
+        """ The message as a dict, suitable to be serialized """
+        return {
+            "type": type(self).__name__,
+            "entity": self.entity,
+            "raw": self.data}
+
 
 class AckMessage(SCSMessage):
     """ Ack message """
@@ -51,6 +58,33 @@ class UnknownMessage(SCSMessage):
         return "UnknownMessage: {0}".format(self._data)
 
 
+class InvalidMessage(UnknownMessage):
+    """ Message rejected by the strict validation of the telegram """
+
+    def __init__(self, data, reason):
+        UnknownMessage.__init__(self, data)
+        self._reason = reason
+
+    @property
+    def reason(self):
+        """ Why the telegram has been rejected, one of
+        ValidationStats.REASONS """
+        return self._reason
+
+    def as_dict(self):
+        """ The message as a dict, suitable to be serialized """
+        result = UnknownMessage.as_dict(self)
+        result["reason"] = self._reason
+        return result
+
+    def __repr__(self):
+        return "InvalidMessage()"
+
+    def __str__(self):
+        return "InvalidMessage: {0} - raw: {1}".format(
+            self._reason, self._data)
+
+
 class StateMessage(SCSMessage):
     """ Message issued to notify a change of state """
 
@@ -72,6 +106,12 @@ class StateMessage(SCSMessage):
                    status=self._status,
                    raw=self._data)
 
+    def as_dict(self):
+        """ The message as a dict, suitable to be serialized """
+        result = SCSMessage.as_dict(self)
+        result.update(source=self._source, status=self._status)
+        return result
+
     @property
     def toggled(self):
         """ True if the light is toggled, False otherwise """
@@ -124,6 +164,15 @@ class CommandMessage(SCSMessage):
         """ Current status """
         return self._status
 
+    def as_dict(self):
+        """ The message as a dict, suitable to be serialized """
+        result = SCSMessage.as_dict(self)
+        result.update(
+            destination=self._destination,
+            source=self._source,
+            status=self._status)
+        return result
+
     def __repr__(self):
         return "CommandMessage()"
 
@@ -162,6 +211,12 @@ class ScenarioTriggeredMessage(SCSMessage):
         """ The source of the message """
         return self._source
 
+    def as_dict(self):
+        """ The message as a dict, suitable to be serialized """
+        result = SCSMessage.as_dict(self)
+        result.update(source=self._source, scenario=self._scenario)
+        return result
+
     def __repr__(self):
         return "ScenarioTriggeredMessage()"
 
@@ -198,6 +253,12 @@ class RequestStatusMessage(SCSMessage):
         """ The source of the message """
         return self._source
 
+    def as_dict(self):
+        """ The message as a dict, suitable to be serialized """
+        result = SCSMessage.as_dict(self)
+        result.update(destination=self._destination, source=self._source)
+        return result
+
     def __repr__(self):
         return "RequestStatusMessage()"
 
@@ -210,8 +271,89 @@ class RequestStatusMessage(SCSMessage):
                     dest=self._destination)
 
 
-def parse(data):
-    """ Parses a raw datagram and return the right type of message """
+class ValidationStats:
+    """ Counters of the telegrams checked by the strict parser """
+
+    REASONS = ("malformed", "bad_start", "bad_end", "bad_checksum")
+
+    def __init__(self):
+        self._accepted = 0
+        self._rejected = dict.fromkeys(self.REASONS, 0)
+
+    def reset(self):
+        """ Sets all the counters to zero """
+        self._accepted = 0
+        self._rejected = dict.fromkeys(self.REASONS, 0)
+
+    def record(self, reason):
+        """ Counts a validated telegram, reason is None when the telegram
+        is valid """
+        if reason is None:
+            self._accepted += 1
+        else:
+            self._rejected[reason] += 1
+
+    def merge(self, other):
+        """ Adds the counters of another ValidationStats instance, for
+        example the ones of a worker process """
+        self._accepted += other.accepted
+        for reason, count in other.rejected.items():
+            self._rejected[reason] += count
+
+    @property
+    def accepted(self):
+        """ Number of valid telegrams """
+        return self._accepted
+
+    @property
+    def rejected(self):
+        """ Dict with the number of rejected telegrams by reason """
+        return dict(self._rejected)
+
+    def as_dict(self):
+        """ All the counters, suitable to be exported as metrics """
+        metrics = {"accepted": self._accepted}
+        metrics.update(
+            ("rejected_" + reason, count)
+            for reason, count in self._rejected.items())
+        return metrics
+
+
+# Counters updated by parse() when strict validation is enabled
+validation_stats = ValidationStats()
+
+
+def validate_telegram(data):
+    """ Checks the framing and the checksum of a telegram expressed as an
+    hex string. Returns None if the telegram is valid, otherwise the
+    reason of the rejection """
+    try:
+        frame = bytes.fromhex(data)
+    except ValueError:
+        return "malformed"
+    if len(frame) < 4:
+        return "malformed"
+    if frame[0] != 0xA8:
+        return "bad_start"
+    if frame[-1] != 0xA3:
+        return "bad_end"
+
+    checksum = 0
+    for value in frame[1:-2]:
+        checksum ^= value
+    if checksum != frame[-2]:
+        return "bad_checksum"
+    return None
+
+
+def parse(data, strict=False):
+    """ Parses a raw datagram and return the right type of message
+
+        data: the datagram (bytes instance)
+        strict: when True the start and end bytes and the checksum of the
+            telegram are verified, invalid telegrams are returned as
+            InvalidMessage and counted inside of validation_stats
+    """
 
     # convert to string
     data = data.decode("ascii")
@@ -219,22 +361,65 @@ def parse(data):
     if len(data) == 2 and data == "A5":
         return AckMessage()
 
+    if strict:
+        reason = validate_telegram(data)
+        validation_stats.record(reason)
+        if reason is not None:
+            return InvalidMessage(
+                [data[i:i+2] for i in range(0, len(data), 2)], reason)
+
     # split into bytes
     raw = [data[i:i+2] for i in range(len(data)) if i % 2 == 0]
 
-    if len(raw) != 7:
+    if len(raw) < 4:
         return UnknownMessage(raw)
 
-    if raw[1] == "B8":
-        return StateMessage(raw)
-    elif raw[3] == "12":
-        return CommandMessage(raw)
-    elif raw[3] == "14":
-        return ScenarioTriggeredMessage(raw)
-    elif raw[3] == "15":
-        return RequestStatusMessage(raw)
+    decoder = _ADDRESS_DECODERS.get((len(raw), raw[1])) or \
+        _COMMAND_DECODERS.get((len(raw), raw[3])) or \
+        UnknownMessage
+    return decoder(raw)
+
+
+# Decoders of the telegrams, indexed by length of the telegram and by
+# either the address byte or the command byte. Address decoders take
+# precedence over command decoders.
+_ADDRESS_DECODERS = {
+    (7, "B8"): StateMessage,
+}
+_COMMAND_DECODERS = {
+    (7, "12"): CommandMessage,
+    (7, "14"): ScenarioTriggeredMessage,
+    (7, "15"): RequestStatusMessage,
+}
+
+
+def register_decoder(decoder, command=None, address=None, length=7):
+    """ Registers a decoder for the telegrams not known by this module
+
+        decoder: callable receiving the list of the bytes of the telegram
+            and returning an instance of SCSMessage
+        command: the command byte (4th byte) handled by the decoder
+        address: the address byte (2nd byte) handled by the decoder,
+            alternative to command
+        length: number of bytes of the handled telegrams
+    """
+    if (command is None) == (address is None):
+        raise ValueError("Either command or address must be specified")
+
+    if address is not None:
+        _ADDRESS_DECODERS[(length, address.upper())] = decoder
     else:
-        return UnknownMessage(raw)
+        _COMMAND_DECODERS[(length, command.upper())] = decoder
+
+
+def unregister_decoder(command=None, address=None, length=7):
+    """ Removes a decoder added with register_decoder """
+    if address is not None:
+        del _ADDRESS_DECODERS[(length, address.upper())]
+    elif command is not None:
+        del _COMMAND_DECODERS[(length, command.upper())]
+    else:
+        raise ValueError("Either command or address must be specified")
 
 
 def checksum_bytes(data):
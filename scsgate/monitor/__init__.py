@@ -4,10 +4,14 @@ import logging
 import pathlib
 import signal
 import sys
-import yaml
 
 import scsgate.messages as messages
 from scsgate.connection import Connection
+from scsgate.log import JsonLinesFormatter, LazyJoin, log_event
+from scsgate.log import setup_async_logging
+from scsgate.homeassistant import HomeAssistantConfig
+from scsgate.reader import FramingError, ReadTimeout
+from scsgate.registry import DeviceRegistry
 
 
 def cli_opts():
@@ -27,6 +31,12 @@ def cli_opts():
         required=False,
         dest="filter",
         help="Ignore events related with these devices",)
+    parser.add_argument(
+        "--filter-cache",
+        type=str,
+        required=False,
+        dest="filter_cache",
+        help="Binary snapshot of the filter file, speeds up the next runs",)
     parser.add_argument(
         "-o",
         "--output",
@@ -34,6 +44,16 @@ def cli_opts():
         required=False,
         dest="output",
         help="Send output to file",)
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        dest="json",
+        help="Log the messages as JSON lines",)
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        dest="strict",
+        help="Verify framing and checksum of the messages",)
     parser.add_argument(
         "-v", "--verbose",
         action="store_true",
@@ -50,32 +70,35 @@ class Monitor:
     def __init__(self, options):
         self._options = options
 
-        # A dict with scs_id as key and another dict as value.
-        # The latter dict has 'ha_id' and 'name' as keys.
-        self._devices = {}
-
-        log_level = logging.WARNING
-
-        if options.output:
-            logging.basicConfig(
-                format='%(asctime)s : %(message)s',
-                level=logging.DEBUG,
-                filename=options.output,
-                filemode="a")
-        else:
-            logging.basicConfig(
-                format='%(asctime)s : %(message)s',
-                level=logging.DEBUG)
-
-        if options.verbose:
-            log_level = logging.DEBUG
-        logging.basicConfig(
-            format='%(asctime)s - %(levelname)s: %(message)s',
-            level=log_level)
+        # The known devices, with their home assistant ID and name
+        self._devices = DeviceRegistry()
+
+        # The messages are formatted and written by a background thread
+        formatter = None
+        if options.json:
+            formatter = JsonLinesFormatter()
+        self._log_listener = setup_async_logging(
+            filename=options.output,
+            formatter=formatter,
+            level=logging.DEBUG)
 
         if self._options.filter:
             self._load_filter(self._options.filter)
 
+        # Saved as soon as new devices are found, the devices it already
+        # contains are not asked again
+        self._config = None
+        if self._options.config:
+            self._config = HomeAssistantConfig(self._options.config)
+            configured = set()
+            for scs_id, ha_id, name in self._config.devices():
+                configured.add(scs_id)
+                self._devices.add(scs_id, ha_id=ha_id, name=name)
+            # the filtered devices have always been part of the output
+            for scs_id, ha_id, name in list(self._devices.devices()):
+                if scs_id not in configured and ha_id is not None:
+                    self._config.add_device(scs_id, ha_id=ha_id, name=name)
+
         self._connection = Connection(device=options.device, logger=logging)
 
         self._setup_signal_handler()
@@ -88,58 +111,74 @@ class Monitor:
 
     def _signal_handler(self, signum, frame):
         """ Method called when handling signals """
-        if self._options.config:
-            with open(self._options.config, "w") as cfg:
-                yaml.dump(self._home_assistant_config(), cfg)
-                print(
-                    "Dumped home assistant configuration at",
-                    self._options.config)
+        if self._config is not None and self._config.dirty:
+            self._config.save()
+            print(
+                "Dumped home assistant configuration at",
+                self._options.config)
+        if self._options.strict:
+            print("Telegram validation:", messages.validation_stats.as_dict())
         self._connection.close()
+        self._log_listener.stop()
         sys.exit(0)
 
     def start(self):
         """ Monitor the bus for events and handle them """
         print("Entering monitoring mode, press CTRL-C to quit")
         serial = self._connection.serial
+        reader = self._connection.reader
+        devices = self._devices
+        filtering = bool(self._options.filter)
+        config = self._config
+        json_output = self._options.json
+        logger = logging.getLogger()
 
         while True:
             serial.write(b"@R")
-            length = int(serial.read(), 16)
-            data = serial.read(length * 2)
-            message = messages.parse(data)
-            if not (self._options.filter and
-                    message.entity and
-                    message.entity in self._devices):
-                logging.debug(" ".join(message.bytes))
-            if not self._options.config or \
-               message.entity is None or \
-               message.entity in self._devices:
+            try:
+                data = reader.read_frame()
+            except ReadTimeout:
+                logging.warning("No answer from SCSGate")
+                continue
+            except FramingError as err:
+                # the reader dropped its buffer, the next frames are read
+                # from a clean state
+                logging.warning(str(err))
+                continue
+            message = messages.parse(data, strict=self._options.strict)
+            if isinstance(message, messages.InvalidMessage):
+                logging.warning(str(message))
+                continue
+            entity = message.entity
+            known = entity in devices
+            if not (filtering and known):
+                if json_output:
+                    log_event(logger, logging.DEBUG, "message",
+                              type=type(message).__name__,
+                              entity=entity,
+                              raw=message.data)
+                else:
+                    logger.debug("%s", LazyJoin(message.bytes))
+            if config is None:
+                continue
+            config.observe(message)
+            config.flush()
+            if entity is None or known:
                 continue
 
             print("New device found")
             ha_id = input("Enter home assistant unique ID: ")
             name = input("Enter name: ")
-            self._add_device(scs_id=message.entity, ha_id=ha_id, name=name)
+            self._add_device(scs_id=entity, ha_id=ha_id, name=name)
 
     def _add_device(self, scs_id, ha_id, name):
         """ Add device to the list of known ones """
         if scs_id in self._devices:
             return
 
-        self._devices[scs_id] = {
-            'name': name,
-            'ha_id': ha_id
-        }
-
-    def _home_assistant_config(self):
-        """ Creates home assistant configuration for the known devices """
-        devices = {}
-        for scs_id, dev in self._devices.items():
-            devices[dev['ha_id']] = {
-                'name': dev['name'],
-                'scs_id': scs_id}
-
-        return {'devices': devices}
+        self._devices.add(scs_id, ha_id=ha_id, name=name)
+        if self._config is not None:
+            self._config.add_device(scs_id, ha_id=ha_id, name=name)
 
     def _load_filter(self, config):
         """ Load the filter file and populates self._devices accordingly """
@@ -147,12 +186,7 @@ class Monitor:
         if not path.is_file():
             return
 
-        with open(config, 'r') as conf:
-            devices = yaml.load(conf)['devices']
-            for ha_id, dev in devices.items():
-                self._devices[dev['scs_id']] = {
-                    ha_id: dev,
-                    'name': dev['name']}
+        self._devices.load(config, cache=self._options.filter_cache)
 
 
 def main():
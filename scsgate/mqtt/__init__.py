@@ -0,0 +1,297 @@
+""" This module implements the scs-mqtt cli tool, a bridge between the
+SCS bus and a MQTT broker.
+
+Messages coming from the bus are published to these topics:
+
+- ``<prefix>/<entity>/state``: ``on`` or ``off``, retained
+- ``<prefix>/<entity>/command``: the JSON of a CommandMessage
+- ``<prefix>/<entity>/scenario``: the ID of the triggered scenario
+
+Commands are received on ``<prefix>/<entity>/set``, the payload is one of
+``on``, ``off``, ``raise``, ``lower``, ``halt`` and ``status``.
+
+Requires the paho-mqtt package.
+"""
+import argparse
+import collections
+import json
+import logging
+import signal
+import sys
+import threading
+
+from scsgate.messages import (
+    CommandMessage, ScenarioTriggeredMessage, StateMessage)
+from scsgate.reactor import Reactor
+from scsgate.tasks import (
+    GetStatusTask, HaltRollerShutterTask, LowerRollerShutterTask,
+    RaiseRollerShutterTask, ToggleStatusTask, check_target)
+
+
+def cli_opts():
+    """ Handle the command line options """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="localhost",
+        dest="host",
+        help="MQTT broker (default: %(default)s)",)
+    parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        default=1883,
+        dest="port",
+        help="MQTT broker port (default: %(default)s)",)
+    parser.add_argument(
+        "--prefix",
+        type=str,
+        default="scsgate",
+        dest="prefix",
+        help="Prefix of all the topics (default: %(default)s)",)
+    parser.add_argument(
+        "--qos",
+        type=int,
+        choices=(0, 1, 2),
+        default=1,
+        dest="qos",
+        help="QoS of the published messages (default: %(default)s)",)
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        dest="strict",
+        help="Verify framing and checksum of the messages",)
+    parser.add_argument(
+        "-v", "--verbose",
+        action="store_true",
+        dest="verbose",
+        help="Verbose output",)
+    parser.add_argument('device')
+
+    return parser.parse_args()
+
+
+def task_from_payload(entity, payload):
+    """ Returns the task matching the payload of a command topic """
+    check_target(entity)
+    if payload == "on":
+        return ToggleStatusTask(target=entity, toggled=True)
+    elif payload == "off":
+        return ToggleStatusTask(target=entity, toggled=False)
+    elif payload == "raise":
+        return RaiseRollerShutterTask(target=entity)
+    elif payload == "lower":
+        return LowerRollerShutterTask(target=entity)
+    elif payload == "halt":
+        return HaltRollerShutterTask(target=entity)
+    elif payload == "status":
+        return GetStatusTask(target=entity)
+
+    raise ValueError("Unknown command {}".format(payload))
+
+
+class Bridge:
+    """ Publishes the messages of the bus to MQTT and turns the MQTT
+    commands into tasks.
+
+    The reactor thread only queues the messages: retained states are
+    coalesced by topic, so only the last state of each entity is kept
+    while the broker is slow, other events are kept in a bounded queue
+    which drops the oldest ones. A separate thread publishes the queued
+    messages in batches """
+
+    def __init__(self, client, prefix="scsgate", qos=1, batch_size=100,
+                 queue_size=10000, flush_interval=0.05, logger=None):
+        """ Initialize the instance
+
+        Arguments:
+        client: MQTT client with the interface of paho.mqtt.client.Client
+        prefix: prefix of all the topics
+        qos: QoS of the published messages
+        batch_size: maximum number of messages published in a row
+        queue_size: maximum number of pending events, retained states
+            are never dropped
+        flush_interval: seconds to wait for more messages before
+            publishing a batch
+        logger: instance of logger
+        """
+        self._client = client
+        self._prefix = prefix
+        self._qos = qos
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._logger = logger or logging.getLogger(__name__)
+
+        self._states = collections.OrderedDict()
+        self._events = collections.deque(maxlen=queue_size)
+        self._condition = threading.Condition()
+        self._dropped = 0
+
+        self._reactor = None
+        self._publisher = None
+        self._terminate = False
+
+    @property
+    def dropped(self):
+        """ Number of events dropped because the broker was too slow """
+        return self._dropped
+
+    def start(self, reactor):
+        """ Installs the callbacks of the MQTT client and starts
+        publishing. Must be invoked before connecting the client: the
+        command topics are subscribed on every connection """
+        self._reactor = reactor
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+
+        self._publisher = threading.Thread(target=self._publish_loop)
+        self._publisher.daemon = True
+        self._publisher.start()
+
+    def stop(self):
+        """ Publishes the pending messages and stops the bridge """
+        with self._condition:
+            self._terminate = True
+            self._condition.notify()
+        if self._publisher is not None:
+            self._publisher.join()
+        while self.flush():
+            pass
+
+    def handle_message(self, message):
+        """ Callback for scsgate.Reactor, queues the message """
+        if message.entity is None:
+            return
+        topic = "{}/{}/".format(self._prefix, message.entity)
+
+        with self._condition:
+            if isinstance(message, StateMessage):
+                self._states.pop(topic + "state", None)
+                self._states[topic + "state"] = message.status
+            elif isinstance(message, CommandMessage):
+                self._push_event(
+                    topic + "command", json.dumps(message.as_dict()))
+            elif isinstance(message, ScenarioTriggeredMessage):
+                self._push_event(topic + "scenario", message.scenario)
+            else:
+                return
+            self._condition.notify()
+
+    def flush(self):
+        """ Publishes a batch of pending messages, returns how many
+        messages have been published """
+        with self._condition:
+            batch = []
+            while self._states and len(batch) < self._batch_size:
+                topic, payload = self._states.popitem(last=False)
+                batch.append((topic, payload, True))
+            while self._events and len(batch) < self._batch_size:
+                topic, payload = self._events.popleft()
+                batch.append((topic, payload, False))
+
+        for topic, payload, retain in batch:
+            self._client.publish(
+                topic, payload, qos=self._qos, retain=retain)
+        return len(batch)
+
+    def _push_event(self, topic, payload):
+        """ Queues an event, the lock must be held by the caller """
+        if len(self._events) == self._events.maxlen:
+            self._dropped += 1
+        self._events.append((topic, payload))
+
+    def _publish_loop(self):
+        """ Body of the publisher thread """
+        while True:
+            with self._condition:
+                while not (self._states or self._events or
+                           self._terminate):
+                    self._condition.wait()
+                if self._terminate:
+                    return
+                # give other messages the chance to join the batch: new
+                # messages notify the condition, they must not end the wait
+                self._condition.wait_for(
+                    lambda: self._terminate or
+                    len(self._states) + len(self._events) >=
+                    self._batch_size,
+                    self._flush_interval)
+                if self._terminate:
+                    return
+
+            while self.flush() == self._batch_size:
+                pass
+
+    def _on_connect(self, client, userdata, flags, rc):
+        """ Invoked by the MQTT client once connected. The broker drops
+        the subscriptions of a clean session: they are made again on
+        every reconnection """
+        if rc != 0:
+            self._logger.warning(
+                "Connection to the MQTT broker refused: {}".format(rc))
+            return
+        client.subscribe("{}/+/set".format(self._prefix), qos=self._qos)
+
+    def _on_message(self, client, userdata, message):
+        """ Invoked by the MQTT client when a command is received """
+        entity = message.topic[len(self._prefix) + 1:].split("/")[0]
+        try:
+            task = task_from_payload(entity, message.payload.decode())
+        except (ValueError, UnicodeDecodeError) as err:
+            self._logger.warning(
+                "Ignoring message on {}: {}".format(message.topic, err))
+            return
+        self._reactor.append_task(task)
+
+
+def main():
+    """ Entry point of the scs-mqtt cli tool """
+
+    try:
+        import paho.mqtt.client as mqtt
+    except ImportError:
+        sys.exit("scs-mqtt requires the paho-mqtt package")
+    from scsgate.connection import Connection
+
+    options = cli_opts()
+
+    log_level = logging.INFO
+    if options.verbose:
+        log_level = logging.DEBUG
+    logging.basicConfig(
+        format='%(asctime)s - %(levelname)s: %(message)s',
+        level=log_level)
+
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+    else:
+        client = mqtt.Client()
+
+    def connect():
+        """ Opens the connection with the SCSGate device """
+        return Connection(device=options.device, logger=logging)
+
+    bridge = Bridge(client, prefix=options.prefix, qos=options.qos)
+    reactor = Reactor(
+        connection=connect(),
+        handle_message=bridge.handle_message,
+        logger=logging,
+        connection_factory=connect,
+        strict=options.strict)
+    bridge.start(reactor)
+    client.connect(options.host, options.port)
+    client.loop_start()
+    reactor.start()
+
+    terminate = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: terminate.set())
+    while not terminate.wait(1):
+        pass
+
+    logging.info("%s", reactor.stop(timeout=2.0, drain=True))
+    bridge.stop()
+    client.loop_stop()
+    client.disconnect()
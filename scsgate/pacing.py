@@ -0,0 +1,86 @@
+""" This module contains the definition of the CommandPacer class.
+This one is used by scsgate.Reactor to not send commands faster than
+the SCS bus can carry them """
+
+import time
+
+
+class CommandPacer:
+    """ Token bucket whose refill rate adapts to the health of the bus.
+
+    The rate grows additively while commands are acknowledged quickly and
+    is cut multiplicatively whenever a command is refused or its
+    acknowledgement takes longer than the target latency """
+
+    def __init__(self, rate=20.0, burst=5, min_rate=2.0, max_rate=100.0,
+                 increase_step=1.0, decrease_factor=0.5,
+                 target_latency=0.05, clock=time.monotonic):
+        """ Initialize the instance
+
+        Arguments:
+        rate: initial number of commands per second
+        burst: maximum number of commands which can be sent back to back
+        min_rate: the rate never goes below this value
+        max_rate: the rate never goes above this value
+        increase_step: commands per second added after each fast ack
+        decrease_factor: factor applied to the rate after a failure
+        target_latency: seconds, slower acks are handled like failures
+        clock: function returning the current time in seconds, used
+            when try_acquire is invoked without the time. The bucket is
+            full at the first call of try_acquire, so the pacer can be
+            created before the clock of the reactor is known
+        """
+        self._rate = rate
+        self._burst = burst
+        self._min_rate = min_rate
+        self._max_rate = max_rate
+        self._increase_step = increase_step
+        self._decrease_factor = decrease_factor
+        self._target_latency = target_latency
+
+        self._clock = clock
+        self._tokens = float(burst)
+        self._last_refill = None
+
+    @property
+    def rate(self):
+        """ Current number of commands per second """
+        return self._rate
+
+    def try_acquire(self, now=None, cost=1):
+        """ Consumes the tokens of a task sending `cost` commands. Returns
+        False if the task has to wait.
+
+        A task costing more than the burst is let through once the bucket
+        is full: the missing tokens are borrowed, and the following
+        commands wait until they are paid back """
+        if now is None:
+            now = self._clock()
+        if self._last_refill is None:
+            self._last_refill = now
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(self._burst, self._tokens + elapsed * self._rate)
+
+        if self._tokens < min(cost, self._burst):
+            return False
+        self._tokens -= cost
+        return True
+
+    def record_success(self, latency):
+        """ Notifies the pacer about an acknowledged command """
+        if latency > self._target_latency:
+            self._slow_down()
+        else:
+            self._rate = min(self._max_rate,
+                             self._rate + self._increase_step)
+
+    def record_failure(self):
+        """ Notifies the pacer about a command refused by the gateway """
+        self._slow_down()
+
+    def _slow_down(self):
+        """ Reduces the rate and drops the tokens accumulated so far """
+        self._rate = max(self._min_rate,
+                         self._rate * self._decrease_factor)
+        self._tokens = min(self._tokens, 1.0)
@@ -0,0 +1,164 @@
+""" This module parses captures of the SCS bus traffic using a pool of
+processes.
+
+A capture is a bytes object holding a sequence of frames, as returned by
+the ``@r`` command of SCSGate: an hex digit with the number of bytes of
+the telegram, followed by the telegram in ASCII. The captures are copied
+once into a shared memory block, each worker receives only the byte
+range of its shard and frames the telegrams by itself.
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+
+from scsgate import messages
+from scsgate.messages import parse, StateMessage
+
+
+def frame_bounds(capture):
+    """ Returns the list of (start, end) offsets of the telegrams inside of
+    a capture. Empty frames are skipped, a truncated frame at the end of
+    the capture is ignored """
+    bounds = []
+    offset = 0
+    size = len(capture)
+    while offset < size:
+        length = int(chr(capture[offset]), 16) * 2
+        start = offset + 1
+        offset = start + length
+        if length and offset <= size:
+            bounds.append((start, offset))
+    return bounds
+
+
+def shard_ranges(capture, shard_size):
+    """ Splits a capture into (start, end) byte ranges holding shard_size
+    frames each. Only the length digits are read, the frames are not
+    decoded """
+    ranges = []
+    first = offset = 0
+    size = len(capture)
+    frames = 0
+    while offset < size:
+        offset += 1 + int(chr(capture[offset]), 16) * 2
+        frames += 1
+        if frames == shard_size:
+            ranges.append((first, min(offset, size)))
+            first = offset
+            frames = 0
+    if first < size:
+        ranges.append((first, size))
+    return ranges
+
+
+def new_stats():
+    """ Returns an empty set of statistics, a dict with the entity IDs as
+    keys """
+    return {}
+
+
+def update_stats(stats, message):
+    """ Accounts a message into the statistics """
+    entity = message.entity
+    if entity is None:
+        return
+    entry = stats.get(entity)
+    if entry is None:
+        entry = stats[entity] = {"count": 0, "types": {}, "status": None}
+    entry["count"] += 1
+    name = type(message).__name__
+    entry["types"][name] = entry["types"].get(name, 0) + 1
+    if isinstance(message, StateMessage):
+        entry["status"] = message.status
+
+
+def merge_stats(stats, other):
+    """ Merges into stats the statistics of the messages following them """
+    for entity, source in other.items():
+        entry = stats.get(entity)
+        if entry is None:
+            stats[entity] = source
+            continue
+        entry["count"] += source["count"]
+        for name, count in source["types"].items():
+            entry["types"][name] = entry["types"].get(name, 0) + count
+        if source["status"] is not None:
+            entry["status"] = source["status"]
+    return stats
+
+
+def parse_frames(buffer, bounds, strict=False):
+    """ Parses the telegrams at the given bounds of buffer and returns
+    their statistics """
+    stats = new_stats()
+    for start, end in bounds:
+        update_stats(stats, parse(bytes(buffer[start:end]), strict=strict))
+    return stats
+
+
+def _parse_shared(args):
+    """ Body of the workers: frames and parses a shard stored in shared
+    memory. Returns its statistics and, with strict validation, the
+    validation counters of the shard """
+    name, start, end, strict = args
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        shard = block.buf[start:end]
+        try:
+            # the counters of the worker account only for this shard
+            messages.validation_stats.reset()
+            stats = parse_frames(shard, frame_bounds(shard), strict)
+        finally:
+            shard.release()
+    finally:
+        block.close()
+    return stats, messages.validation_stats if strict else None
+
+
+def analyse(captures, processes=None, shard_size=20000, strict=False):
+    """ Parses many captures in parallel
+
+        captures: list of captures (bytes instances)
+        processes: number of worker processes, by default the number of
+            CPUs. With 1 the captures are parsed by the calling process
+        shard_size: number of telegrams parsed by a worker in one go
+        strict: validate framing and checksum of the telegrams, the
+            counters of the workers are added to messages.validation_stats
+
+        returns: a list with the statistics of each capture, in the same
+            order as captures. The statistics are a dict with the entity
+            IDs as keys and dicts with the number of messages ("count"),
+            the number of messages by type ("types") and the last known
+            status ("status") as values
+    """
+    if processes == 1:
+        return [parse_frames(capture, frame_bounds(capture), strict)
+                for capture in captures]
+
+    total = sum(len(capture) for capture in captures)
+    block = shared_memory.SharedMemory(create=True, size=max(total, 1))
+    try:
+        # (capture index, start, end) of each shard, in order
+        shards = []
+        offset = 0
+        for index, capture in enumerate(captures):
+            block.buf[offset:offset + len(capture)] = capture
+            for start, end in shard_ranges(capture, shard_size):
+                shards.append((index, start + offset, end + offset))
+            offset += len(capture)
+
+        with multiprocessing.Pool(processes) as pool:
+            shard_stats = pool.map(
+                _parse_shared,
+                [(block.name, start, end, strict)
+                 for _, start, end in shards])
+    finally:
+        block.close()
+        block.unlink()
+
+    results = [new_stats() for _ in captures]
+    for (index, _, _), (stats, counters) in zip(shards, shard_stats):
+        merge_stats(results[index], stats)
+        if counters is not None:
+            messages.validation_stats.merge(counters)
+    return results
@@ -2,60 +2,699 @@
 This one is useful when dealing with concurrent access to the SCSGate
 device """
 
+import collections
+import heapq
+import itertools
+import logging
 import queue
+import random
 import threading
+import time
 
-from scsgate.tasks import MonitorTask, ExecutionError
+from scsgate.coalesce import StateCoalescer
+from scsgate.messages import StateMessage
+from scsgate.reader import FramingError, ReadCancelled, ReadTimeout
+from scsgate.registry import DeviceRegistry
+from scsgate.tasks import (
+    BasicTask, MonitorTask, GetStatusTask, SetStatusTask, ExecutionError)
+
+
+# Seconds of silence after which SCSGate is considered resynchronized
+SETTLE_TIME = 0.05
 
 
 class Reactor(threading.Thread):
     """ Allows concurrent access to the SCSGate device """
 
-    def __init__(self, connection, handle_message, logger=None):
+    def __init__(self, connection, handle_message, logger=None,
+                 connection_factory=None, backoff_initial=0.5,
+                 backoff_max=30.0, resync_interval=0.1, pacer=None,
+                 max_retries=0, retry_delay=0.2, strict=False, ring=None,
+                 coalesce_window=None, health=None, registry=None,
+                 journal=None, clock=time.monotonic, sleep=None):
         """ Initialize the instance
 
         Arguments
         connection: a scsgate.Connection object
         handle_message: callback function to invoke whenever a new message
             is received
-        logger: instance of logger
+        logger: instance of logger, by default the one of this module
+        connection_factory: callable returning a new scsgate.Connection,
+            used to reconnect when the serial device fails. When None
+            I/O failures are fatal, as they have always been
+        backoff_initial: seconds to wait before the first reconnection
+            attempt, doubled after every failed attempt
+        backoff_max: upper bound of the reconnection delay
+        resync_interval: seconds between two status requests sent to
+            resynchronize the known entities after a reconnection
+        pacer: a scsgate.pacing.CommandPacer limiting the rate of the
+            commands sent to the bus. When None commands are sent as
+            fast as the serial port takes them
+        max_retries: number of times a failed SetStatusTask is tried
+            again
+        retry_delay: seconds to wait before the first retry, doubled
+            after every failure and randomized to avoid bursts
+        strict: verify framing and checksum of the received telegrams,
+            see scsgate.messages.parse
+        ring: a scsgate.ringbuffer.MessageRing receiving the raw telegram
+            of every message
+        coalesce_window: when set, the state messages of each entity are
+            held for this many seconds and only the last one is passed to
+            handle_message, see scsgate.coalesce.StateCoalescer
+        health: a scsgate.health.HealthMonitor fed with the heartbeat of
+            the loop, the duration of the poll cycles and the arrival of
+            the messages
+        registry: a scsgate.registry.DeviceRegistry, the entities which
+            report their state are added to it and all its entities are
+            resynchronized after a reconnection
+        journal: a scsgate.journal.TaskJournal persisting the queued tasks
+            until they are executed. The tasks left by the previous run
+            are queued right away
+        clock: function returning the current time in seconds, used for
+            all the timings of the reactor
+        sleep: function waiting for the given number of seconds, by
+            default a wait interrupted by stop()
         """
 
         threading.Thread.__init__(self)
+        self._clock = clock
         self._connection = connection
         self._handle_message = handle_message
-        self._terminate = False
-        self._logger = logger
+        self._terminate = threading.Event()
+        self._sleep = sleep or self._terminate.wait
+        # ShutdownReport created by stop()
+        self._report = None
+        # thread executing run()
+        self._runner = None
+        self._logger = logger or logging.getLogger(__name__)
         self._request_queue = queue.Queue()
 
+        self._connection_factory = connection_factory
+        self._backoff_initial = backoff_initial
+        self._backoff_max = backoff_max
+        self._resync_interval = resync_interval
+
+        self._pacer = pacer
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        # id() of the tasks being retried -> number of failed attempts.
+        # Equal tasks queued twice are retried independently
+        self._attempts = {}
+
+        self._strict = strict
+        self._ring = ring
+
+        self._coalescer = None
+        if coalesce_window is not None:
+            self._coalescer = StateCoalescer(
+                handle_message, window=coalesce_window, clock=clock)
+            self._handle_message = self._coalescer.handle_message
+
+        self._health = health
+
+        self._journal = journal
+        if journal is not None:
+            for task in journal.pending():
+                self._request_queue.put(task)
+
+        # Tasks which must not run before a given time. Each item is a
+        # (due time, sequence number, task) tuple kept as a heap.
+        self._delayed_tasks = []
+        self._delayed_counter = itertools.count()
+
+        # The entities listed by the user plus the ones which reported their
+        # state at least once
+        self._registry = registry if registry is not None \
+            else DeviceRegistry()
+
+        # Callbacks invoked, in the reactor thread, for every message
+        self._listeners = ()
+        self._listeners_lock = threading.Lock()
+
+        # Task waiting for the pacer to have enough tokens
+        self._held_task = None
+
+        # True when an answer of SCSGate may still be on its way
+        self._out_of_sync = False
+
     def run(self):
         """ Starts the thread """
 
+        self._runner = threading.current_thread()
         task = None
         monitor_task = MonitorTask(
-            notification_endpoint=self._handle_message)
+            notification_endpoint=self._dispatch_message,
+            strict=self._strict,
+            raw_endpoint=self._ring.append if self._ring else None)
 
         while True:
-            if self._terminate:
-                self._logger.info("scsgate.Reactor exiting")
-                self._connection.close()
+            if self._terminate.is_set():
+                self._shutdown(task, monitor_task)
                 break
-            try:
-                task = self._request_queue.get_nowait()
-                self._logger.debug("scsgate.Reactor: got task {}".format(task))
-            except queue.Empty:
-                task = monitor_task
+
+            if self._coalescer is not None:
+                self._coalescer.flush(self._clock())
+            if self._health is not None:
+                self._health.heartbeat(self._clock())
+
+            if self._out_of_sync:
+                try:
+                    self._abort_operation()
+                    self._out_of_sync = False
+                    self._logger.info("scsgate.Reactor: resynchronized")
+                except ReadCancelled:
+                    continue
+                except ExecutionError as err:
+                    self._logger.error(
+                        "scsgate.Reactor: cannot resynchronize: %s", err)
+                    continue
+                except OSError as err:
+                    if self._connection_factory is None:
+                        raise
+                    self._logger.error(
+                        "scsgate.Reactor: connection lost: %s", err)
+                    # nothing can be left over on a new connection
+                    if self._reconnect():
+                        self._out_of_sync = False
+                    continue
+
+            if task is None:
+                task = self._next_task(monitor_task)
 
             try:
-                task.execute(connection=self._connection)
+                self._execute(task, monitor_task)
+            except ReadCancelled:
+                # woken up by stop(), the task is handed to _shutdown
+                continue
             except ExecutionError as err:
                 self._logger.error(err)
+                if isinstance(err, (ReadTimeout, FramingError)):
+                    # a late answer would be taken for the one of the next
+                    # task
+                    self._out_of_sync = True
+                self._handle_failure(task, monitor_task)
+            except OSError as err:
+                if self._connection_factory is None:
+                    raise
+                self._logger.error(
+                    "scsgate.Reactor: connection lost: %s", err)
+                if not self._reconnect():
+                    continue
+                # the interrupted task is executed again on the new
+                # connection, unless it was the monitor task
+                if task is not monitor_task:
+                    continue
+            task = None
+
+    def stop(self, timeout=None, drain=False):
+        """ Stops the thread and closes the associated connection.
+
+        The loop is woken up at once: the read in progress on the serial
+        port is cancelled. The queued tasks are not executed, unless drain
+        is set; the ones left are listed in the report, so that they can
+        be persisted and queued again later.
+
+        Arguments:
+        timeout: seconds granted to the whole shutdown, draining
+            included. When None the method returns without waiting for
+            the thread
+        drain: execute the queued tasks before closing the connection,
+            as long as the deadline allows it
+
+        Returns the ShutdownReport, complete once its `finished` attribute
+        is True
+        """
+        if self._report is None:
+            now = self._clock()
+            self._report = ShutdownReport(
+                requested_at=now,
+                deadline=None if timeout is None else now + timeout,
+                drain=drain)
+        reader = getattr(self._connection, "reader", None)
+        if reader is not None:
+            reader.cancel()
+        # set last: the reader must not be cancelled once _shutdown runs
+        self._terminate.set()
 
-    def stop(self):
-        """ Blocks the thread, performs cleanup of the associated
-        connection """
-        self._terminate = True
+        if timeout is not None and \
+           threading.current_thread() is not self._runner:
+            self._report.wait(timeout)
+        return self._report
+
+    @property
+    def shutdown_report(self):
+        """ The ShutdownReport of the last stop(), None if the reactor has
+        not been stopped """
+        return self._report
 
     def append_task(self, task):
         """ Adds a tasks to the list of the jobs to execute """
+        if self._journal is not None:
+            self._journal.append(task)
         self._request_queue.put(task)
+
+    def schedule_task(self, task, delay):
+        """ Adds a task to be executed not before `delay` seconds from now.
+        Must be invoked from the reactor thread """
+        heapq.heappush(
+            self._delayed_tasks,
+            (self._clock() + delay, next(self._delayed_counter), task))
+
+    def add_listener(self, listener):
+        """ Registers a callable invoked for every message received, right
+        before the main callback. Listeners run in the reactor thread and
+        must not block """
+        with self._listeners_lock:
+            self._listeners = self._listeners + (listener,)
+
+    def remove_listener(self, listener):
+        """ Unregisters a callable added with add_listener """
+        with self._listeners_lock:
+            self._listeners = tuple(
+                item for item in self._listeners if item is not listener)
+
+    def refresh_all(self, entities, window=4, timeout=2.0):
+        """ Requests the status of many entities, keeping at most `window`
+        requests in flight, and waits for their answers.
+
+        Must not be invoked from the reactor thread.
+
+        Arguments:
+        entities: iterable with the IDs of the entities to refresh
+        window: maximum number of status requests waiting for an answer
+        timeout: seconds to wait for the answer of each entity, from the
+            moment its request is sent to SCSGate
+
+        Returns a dict with the entity IDs as keys and the received
+        StateMessage as values, None for the entities which did not
+        answer in time. The method gives up when the reactor stops or its
+        thread dies, and after the time needed by all the batches of
+        `window` requests, plus the one of a batch for the tasks queued
+        before them
+        """
+        refresh = _StatusRefresh(self, entities, window, timeout)
+        batches = -(-len(refresh.results) // window)
+        # the caller is blocked in real time, whatever the reactor clock
+        give_up_at = time.monotonic() + (batches + 1) * timeout
+        refresh.start()
+        try:
+            while not refresh.wait(timeout):
+                if self._terminate.is_set() or not self._running() or \
+                   time.monotonic() >= give_up_at:
+                    break
+        finally:
+            refresh.close()
+        return refresh.results
+
+    def _running(self):
+        """ True while the thread executing run() is alive """
+        return self._runner is not None and self._runner.is_alive()
+
+    @property
+    def known_entities(self):
+        """ IDs of the entities of the registry: the ones given by the user
+        plus the ones which reported their state so far """
+        return frozenset(self._registry.entities)
+
+    def _next_task(self, monitor_task):
+        """ Returns the next task to execute: due delayed tasks come first,
+        then queued ones and finally the monitor task. A task is held
+        back while the pacer has not enough tokens for its commands, the
+        due delayed tasks which send nothing to the bus run meanwhile """
+        now = self._clock()
+        task = self._held_task
+        if task is not None:
+            # tasks which do not use the bus never wait for the pacer
+            free_task = self._pop_free_task(now)
+            if free_task is not None:
+                return free_task
+        else:
+            if self._delayed_tasks and self._delayed_tasks[0][0] <= now:
+                task = heapq.heappop(self._delayed_tasks)[2]
+            else:
+                try:
+                    task = self._request_queue.get_nowait()
+                except queue.Empty:
+                    return monitor_task
+                self._logger.debug("scsgate.Reactor: got task %s", task)
+
+        if self._pacer is not None and task.cost and \
+           not self._pacer.try_acquire(now, task.cost):
+            self._held_task = task
+            return monitor_task
+        self._held_task = None
+        return task
+
+    def _pop_free_task(self, now):
+        """ Removes and returns the first due delayed task which sends no
+        command to the bus, None if there is none """
+        due = [entry for entry in self._delayed_tasks
+               if entry[0] <= now and not entry[2].cost]
+        if not due:
+            return None
+        entry = min(due)
+        self._delayed_tasks.remove(entry)
+        heapq.heapify(self._delayed_tasks)
+        return entry[2]
+
+    def _execute(self, task, monitor_task):
+        """ Executes the task, feeding the pacer with the ack latency of
+        the commands """
+        start = self._clock()
+        task.execute(connection=self._connection)
+        if task is monitor_task:
+            if self._health is not None:
+                self._health.record_poll(self._clock() - start)
+            return
+        if not task.cost:
+            # bookkeeping task, nothing has been sent to the bus
+            return
+        # the answer to a status request, or the echo of a command, may be
+        # identical to the last state message seen: it must not be filtered
+        # out as a duplicate
+        monitor_task.reset()
+
+        self._attempts.pop(id(task), None)
+        if self._journal is not None:
+            self._journal.complete(task)
+        if self._pacer is not None and task.cost:
+            # the latency of a single command
+            self._pacer.record_success(
+                (self._clock() - start) / task.cost)
+
+    def _handle_failure(self, task, monitor_task):
+        """ Slows down the pacer and schedules the retry of failed
+        SetStatusTasks """
+        if task is monitor_task:
+            # a poll without answer says nothing about the commands
+            return
+        if self._pacer is not None:
+            self._pacer.record_failure()
+        attempts = self._attempts.get(id(task), 0) + 1
+        if not isinstance(task, SetStatusTask) or \
+           attempts > self._max_retries:
+            # given up
+            self._attempts.pop(id(task), None)
+            if self._journal is not None:
+                self._journal.complete(task)
+            return
+        self._attempts[id(task)] = attempts
+        delay = self._retry_delay * (2 ** (attempts - 1))
+        self.schedule_task(task, delay * random.uniform(0.5, 1.5))
+
+    def _dispatch_message(self, message):
+        """ Keeps track of the known entities and forwards the message to
+        the user callback """
+        if isinstance(message, StateMessage) and \
+           message.entity not in self._registry:
+            self._registry.add(message.entity)
+        if self._health is not None:
+            self._health.record_message(self._clock())
+        for listener in self._listeners:
+            listener(message)
+        self._handle_message(message)
+
+    def _reconnect(self):
+        """ Replaces the broken connection with a new one, retrying with
+        an exponential backoff. Returns False if the reactor has been
+        stopped in the meantime """
+        try:
+            self._connection.serial.close()
+        except OSError:
+            pass
+
+        delay = self._backoff_initial
+        while not self._terminate.is_set():
+            self._sleep(delay)
+            try:
+                self._connection = self._connection_factory()
+            except (OSError, RuntimeError) as err:
+                self._logger.warning(
+                    "scsgate.Reactor: reconnection failed: %s", err)
+                delay = min(delay * 2, self._backoff_max)
+                continue
+
+            self._logger.info("scsgate.Reactor: reconnected")
+            self._schedule_resync()
+            return True
+
+        # keep run() from closing the broken connection a second time
+        self._connection = _ClosedConnection()
+        return False
+
+    def _shutdown(self, task, monitor_task):
+        """ Drains or drops the pending tasks, then closes the connection.
+        task is the one interrupted by stop(), if any """
+        report = self._report
+        self._logger.info("scsgate.Reactor exiting")
+
+        reader = getattr(self._connection, "reader", None)
+        if reader is not None:
+            reader.resume()
+
+        pending = collections.deque()
+        if task is not None and task is not monitor_task:
+            report.interrupted = task
+            pending.append(task)
+        if self._held_task is not None:
+            pending.append(self._held_task)
+            self._held_task = None
+        pending.extend(self._pop_queued())
+        if report.drain and pending and reader is not None:
+            self._drain(pending, task is not None, monitor_task)
+
+        report.dropped = list(pending) + [
+            item[2] for item in sorted(self._delayed_tasks)]
+        self._delayed_tasks = []
+        if report.dropped:
+            self._logger.warning(
+                "scsgate.Reactor: %d tasks dropped", len(report.dropped))
+
+        if self._coalescer is not None:
+            self._coalescer.flush_all()
+        self._connection.close()
+        report.finish(self._clock())
+
+    def _drain(self, pending, interrupted, monitor_task):
+        """ Executes the pending tasks until the deadline of the shutdown.
+        The executed tasks are removed from pending """
+        report = self._report
+        try:
+            if interrupted:
+                self._abort_operation()
+            while pending:
+                if report.deadline is not None and \
+                   self._clock() >= report.deadline:
+                    return
+                task = pending.popleft()
+                try:
+                    self._execute(task, monitor_task)
+                    report.executed.append(task)
+                except ExecutionError as err:
+                    self._logger.error(err)
+                    report.failed.append(task)
+                    if self._journal is not None:
+                        self._journal.complete(task)
+                # tasks may queue other tasks, like the verification ones
+                pending.extend(self._pop_queued())
+        except (ExecutionError, OSError) as err:
+            self._logger.error(
+                "scsgate.Reactor: cannot drain the queue: %s", err)
+
+    def _abort_operation(self):
+        """ Makes SCSGate abandon the operation which timed out or was
+        interrupted by stop(), so that its answer is not mistaken for the
+        one of the next task """
+        reader = self._connection.reader
+        reader.clear()
+        reset_input_buffer = getattr(
+            self._connection.serial, "reset_input_buffer", None)
+        if reset_input_buffer is not None:
+            reset_input_buffer()
+        self._connection.serial.write(b"@c")
+        # the telegrams are made of hex digits, they cannot contain a "k"
+        while reader.read(1) != b"k":
+            pass
+        # the late ack of the abandoned operation may follow the one of @c
+        try:
+            while True:
+                reader.read(1, timeout=SETTLE_TIME)
+        except ReadCancelled:
+            raise
+        except ReadTimeout:
+            pass
+
+    def _pop_queued(self):
+        """ Removes and returns all the queued tasks """
+        tasks = []
+        while True:
+            try:
+                tasks.append(self._request_queue.get_nowait())
+            except queue.Empty:
+                return tasks
+
+    def _schedule_resync(self):
+        """ Requests the status of all the known entities, spacing the
+        requests by resync_interval to not flood the bus """
+        for index, entity in enumerate(self._registry.entities):
+            self.schedule_task(
+                GetStatusTask(target=entity),
+                index * self._resync_interval)
+
+
+class ShutdownReport:
+    """ Outcome of Reactor.stop """
+
+    def __init__(self, requested_at, deadline=None, drain=False):
+        self.requested_at = requested_at
+        self.deadline = deadline
+        self.drain = drain
+        # tasks executed, or failed, while draining the queue
+        self.executed = []
+        self.failed = []
+        # task in progress when stop() was invoked
+        self.interrupted = None
+        # tasks not executed, in the order they would have run
+        self.dropped = []
+        # seconds between stop() and the closure of the connection
+        self.elapsed = None
+        self._finished = threading.Event()
+
+    @property
+    def finished(self):
+        """ True once the connection has been closed """
+        return self._finished.is_set()
+
+    def finish(self, now):
+        """ Invoked by the reactor thread once the connection is closed """
+        self.elapsed = now - self.requested_at
+        self._finished.set()
+
+    def wait(self, timeout=None):
+        """ Waits for the end of the shutdown, returns True if it ended """
+        return self._finished.wait(timeout)
+
+    def __str__(self):
+        return "ShutdownReport: {} executed, {} failed, {} dropped".format(
+            len(self.executed), len(self.failed), len(self.dropped))
+
+
+class _StatusRefresh:
+    """ Correlates the status requests issued by Reactor.refresh_all with
+    the state messages coming from the bus. The deadlines are handled in
+    the reactor thread, with the clock of the reactor """
+
+    def __init__(self, reactor, entities, window, timeout):
+        if window <= 0:
+            raise ValueError("window must be positive, not {}".format(
+                window))
+        self._reactor = reactor
+        self._pending = collections.deque(dict.fromkeys(entities))
+        self._window = window
+        self._timeout = timeout
+        # entity ID -> True once the request has been sent, False while
+        # it is queued
+        self._in_flight = {}
+        self._results = dict.fromkeys(self._pending)
+        self._condition = threading.Condition()
+
+    @property
+    def done(self):
+        """ True when all the entities answered or timed out """
+        return not (self._pending or self._in_flight)
+
+    @property
+    def results(self):
+        """ Entity ID -> StateMessage, None when there is no answer """
+        with self._condition:
+            return dict(self._results)
+
+    def start(self):
+        """ Queues the first requests """
+        self._reactor.add_listener(self.handle_message)
+        with self._condition:
+            self._send_next()
+
+    def wait(self, timeout=None):
+        """ Waits for the completion of the refresh. Returns False if the
+        timeout expired """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.done, timeout)
+
+    def close(self):
+        """ Stops watching the messages of the reactor """
+        self._reactor.remove_listener(self.handle_message)
+
+    def handle_message(self, message):
+        """ Completes the request of the entity the message is about """
+        if not isinstance(message, StateMessage):
+            return
+        with self._condition:
+            if self._in_flight.get(message.entity):
+                del self._in_flight[message.entity]
+                self._results[message.entity] = message
+                self._send_next()
+
+    def _sent(self, entity):
+        """ Starts the deadline of a request, invoked by the reactor thread
+        right before sending it """
+        with self._condition:
+            if entity not in self._in_flight:
+                return
+            self._in_flight[entity] = True
+        self._reactor.schedule_task(
+            _RefreshDeadline(self, entity), self._timeout)
+
+    def _expire(self, entity):
+        """ Gives up on an entity which did not answer in time """
+        with self._condition:
+            if self._in_flight.pop(entity, None):
+                self._send_next()
+
+    def _send_next(self):
+        """ Fills the window with new requests, must be invoked with the
+        lock held """
+        while self._pending and len(self._in_flight) < self._window:
+            entity = self._pending.popleft()
+            self._in_flight[entity] = False
+            self._reactor.append_task(_RefreshRequest(self, entity))
+        if self.done:
+            self._condition.notify_all()
+
+
+class _RefreshRequest(GetStatusTask):
+    """ Status request of Reactor.refresh_all """
+
+    def __init__(self, refresh, entity):
+        GetStatusTask.__init__(self, target=entity)
+        self._refresh = refresh
+
+    def execute(self, connection):
+        self._refresh._sent(self.target)
+        GetStatusTask.execute(self, connection)
+
+
+class _RefreshDeadline(BasicTask):
+    """ Runs in the reactor thread when the answer of a status request of
+    Reactor.refresh_all is overdue """
+
+    # no command is sent to the bus
+    cost = 0
+
+    def __init__(self, refresh, entity):
+        self._refresh = refresh
+        self._entity = entity
+
+    def execute(self, connection):
+        self._refresh._expire(self._entity)
+
+    def __str__(self):
+        return "Deadline of the status of {}".format(self._entity)
+
+
+class _ClosedConnection:
+    """ Placeholder for a connection which has already been dropped """
+
+    def close(self):
+        """ Nothing to close """
+        pass
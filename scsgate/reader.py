@@ -0,0 +1,133 @@
+""" This module contains the definition of the BufferedReader class.
+This one reads from the serial port in bulk and serves the responses of
+SCSGate from its buffer """
+
+import time
+
+from scsgate.tasks import ExecutionError
+
+
+class ReadTimeout(ExecutionError):
+    """ Error raised when SCSGate does not answer before the deadline """
+    pass
+
+
+class ReadCancelled(ReadTimeout):
+    """ Error raised when a read is interrupted by BufferedReader.cancel """
+    pass
+
+
+class FramingError(ExecutionError):
+    """ Error raised when the answer of SCSGate is not a valid frame, for
+    example because a late answer to a previous operation arrived """
+    pass
+
+
+class BufferedReader:
+    """ Reads all the bytes waiting on the serial port at once, so that
+    many responses can be served with a single read.
+
+    The serial port should be opened with a short timeout: the reader
+    keeps reading until the deadline of the operation expires """
+
+    def __init__(self, serial, timeout=None, clock=time.monotonic):
+        """ Initialize the instance
+
+        Arguments:
+        serial: the pyserial.Serial instance
+        timeout: default deadline of the read operations, in seconds.
+            None waits forever
+        clock: function returning the current time in seconds
+        """
+        self._serial = serial
+        self._clock = clock
+        self._timeout = timeout
+        self._buffer = bytearray()
+        self._position = 0
+        self._reads = 0
+        self._cancelled = False
+
+    @property
+    def buffered(self):
+        """ Number of bytes read from the port but not consumed yet """
+        return len(self._buffer) - self._position
+
+    @property
+    def reads(self):
+        """ Number of reads performed on the serial port """
+        return self._reads
+
+    def read(self, size, timeout=None):
+        """ Returns exactly size bytes, raises ReadTimeout if they do not
+        arrive in time. When timeout is None the default one is used """
+        return self._read(size, self._deadline(timeout))
+
+    def read_frame(self, timeout=None):
+        """ Reads a frame made by an hex digit with the number of bytes of
+        the telegram, followed by the telegram in ASCII. Returns the
+        telegram, an empty bytes instance when the length is zero """
+        deadline = self._deadline(timeout)
+        digit = self._read(1, deadline)
+        try:
+            length = int(digit, 16)
+        except ValueError:
+            self.clear()
+            raise FramingError(
+                "Unexpected answer {} instead of a frame length".format(
+                    digit))
+        return self._read(length * 2, deadline)
+
+    def clear(self):
+        """ Discards the buffered bytes """
+        del self._buffer[:]
+        self._position = 0
+
+    def cancel(self):
+        """ Interrupts the read in progress, and makes the following ones
+        fail, until resume() is invoked. Can be invoked from any thread """
+        self._cancelled = True
+        # wakes up a blocking read of pyserial, where supported
+        cancel_read = getattr(self._serial, "cancel_read", None)
+        if cancel_read is not None:
+            cancel_read()
+
+    def resume(self):
+        """ Allows reading again after cancel() """
+        self._cancelled = False
+
+    def _deadline(self, timeout):
+        """ Converts a timeout into an absolute deadline """
+        if timeout is None:
+            timeout = self._timeout
+        if timeout is None:
+            return None
+        return self._clock() + timeout
+
+    def _read(self, size, deadline):
+        """ Consumes size bytes from the buffer, filling it as needed. On
+        timeout the partial answer is discarded """
+        try:
+            while self.buffered < size:
+                self._fill(deadline)
+        except ReadTimeout:
+            self.clear()
+            raise
+        start = self._position
+        self._position += size
+        return bytes(self._buffer[start:self._position])
+
+    def _fill(self, deadline):
+        """ Appends to the buffer all the bytes waiting on the port, or
+        waits for at least one of them """
+        if self._cancelled:
+            raise ReadCancelled("Read cancelled")
+        if deadline is not None and self._clock() >= deadline:
+            raise ReadTimeout("No answer from SCSGate")
+
+        # drop the consumed bytes before growing the buffer
+        if self._position:
+            del self._buffer[:self._position]
+            self._position = 0
+
+        self._buffer += self._serial.read(max(1, self._serial.in_waiting))
+        self._reads += 1
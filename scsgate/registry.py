@@ -0,0 +1,112 @@
+""" This module contains the definition of the DeviceRegistry class,
+the list of the devices known by scs-monitor and scsgate.Reactor """
+
+import marshal
+import os
+import sys
+
+import yaml
+
+from scsgate.homeassistant import YamlLoader
+
+
+class DeviceRegistry:
+    """ Assigns to each known entity ID a small integer index, the
+    attributes of the devices are kept in flat lists addressed by that
+    index """
+
+    def __init__(self):
+        # entity ID -> index
+        self._index = {}
+        self._entities = []
+        self._ha_ids = []
+        self._names = []
+
+    def __contains__(self, entity):
+        return entity in self._index
+
+    def __len__(self):
+        return len(self._entities)
+
+    @property
+    def entities(self):
+        """ The IDs of the known entities, in order of registration """
+        return list(self._entities)
+
+    def index(self, entity):
+        """ Returns the index of the entity, None if it's not known """
+        return self._index.get(entity)
+
+    def add(self, entity, ha_id=None, name=None):
+        """ Registers a device and returns its index. The home assistant ID
+        and the name of known devices are updated when given """
+        index = self._index.get(entity)
+        if index is None:
+            index = len(self._entities)
+            self._index[entity] = index
+            self._entities.append(entity)
+            self._ha_ids.append(ha_id)
+            self._names.append(name)
+            return index
+
+        if ha_id is not None:
+            self._ha_ids[index] = ha_id
+        if name is not None:
+            self._names[index] = name
+        return index
+
+    def devices(self):
+        """ Yields a (entity ID, home assistant ID, name) tuple for each
+        device """
+        return zip(self._entities, self._ha_ids, self._names)
+
+    def load(self, path, cache=None):
+        """ Adds the devices listed inside of a YAML document in the format
+        produced by scs-monitor.
+
+        Arguments:
+        path: the YAML document
+        cache: optional path of a binary snapshot of the devices, used
+            instead of the document as long as the document and the
+            version of Python do not change. Nothing is written when None
+        """
+        stat = os.stat(path)
+        # the marshal format depends on the version of Python
+        key = [stat.st_mtime_ns, stat.st_size, list(sys.version_info[:2])]
+        if cache is not None:
+            try:
+                with open(cache, "rb") as snapshot:
+                    cached_key, devices = marshal.load(snapshot)
+                if cached_key == key:
+                    for entity, ha_id, name in devices:
+                        self.add(entity, ha_id, name)
+                    return
+            except (OSError, EOFError, ValueError, TypeError):
+                pass
+
+        with open(path, "r") as conf:
+            document = yaml.load(conf, Loader=YamlLoader) or {}
+        devices = [
+            (str(dev["scs_id"]), ha_id, dev.get("name"))
+            for ha_id, dev in (document.get("devices") or {}).items()]
+        for entity, ha_id, name in devices:
+            self.add(entity, ha_id, name)
+
+        if cache is not None:
+            self._save_snapshot(cache, key, devices)
+
+    @staticmethod
+    def _save_snapshot(cache, key, devices):
+        """ Writes the snapshot to a temporary file renamed over the old
+        one. Devices holding values marshal cannot store, like the tagged
+        ones of home assistant, are not cached """
+        temporary = cache + ".tmp"
+        try:
+            with open(temporary, "wb") as snapshot:
+                marshal.dump((key, devices), snapshot)
+            os.replace(temporary, cache)
+        except (OSError, ValueError):
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
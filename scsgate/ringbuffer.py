@@ -0,0 +1,130 @@
+""" This module contains the definition of the MessageRing class, a
+fixed capacity buffer of raw telegrams written by scsgate.Reactor and
+read by any number of consumers """
+
+import array
+
+
+class MessageRing:
+    """ Ring of preallocated slots, each one holding a raw telegram.
+
+    There must be a single writer. Readers use their own RingCursor and
+    never block the writer: when a reader is too slow the oldest records
+    are overwritten and the cursor reports the overrun """
+
+    def __init__(self, capacity=1024, slot_size=32):
+        """ Initialize the instance
+
+        Arguments:
+        capacity: number of records kept by the ring
+        slot_size: maximum size of a record, in bytes
+        """
+        self._capacity = capacity
+        self._slot_size = slot_size
+        self._buffer = bytearray(capacity * slot_size)
+        self._view = memoryview(self._buffer)
+        self._lengths = array.array("H", bytes(2 * capacity))
+        # Number of records written so far, the next record goes to the
+        # slot write_count % capacity
+        self._write_count = 0
+        # Number of records whose writing has started, used by the readers
+        # to detect a slot overwritten while they were copying it
+        self._write_started = 0
+
+    @property
+    def capacity(self):
+        """ Number of records kept by the ring """
+        return self._capacity
+
+    @property
+    def write_count(self):
+        """ Number of records written so far """
+        return self._write_count
+
+    def append(self, data):
+        """ Stores a record, overwriting the oldest one when the ring is
+        full. Records longer than slot_size are truncated """
+        index = self._write_count % self._capacity
+        length = len(data)
+        if length > self._slot_size:
+            length = self._slot_size
+            data = data[:length]
+        offset = index * self._slot_size
+
+        self._write_started = self._write_count + 1
+        self._view[offset:offset + length] = data
+        self._lengths[index] = length
+        # publish the record only once it has been completely written
+        self._write_count += 1
+
+    def cursor(self, from_start=False):
+        """ Returns a new RingCursor positioned after the last record, or
+        on the oldest record still available when from_start is True """
+        position = self._write_count
+        if from_start:
+            position = max(0, position - self._capacity)
+        return RingCursor(self, position)
+
+
+class RingCursor:
+    """ Reading position of a consumer of a MessageRing """
+
+    def __init__(self, ring, position):
+        self._ring = ring
+        self._position = position
+        self._overruns = 0
+
+    @property
+    def overruns(self):
+        """ Number of records lost because the consumer was too slow """
+        return self._overruns
+
+    @property
+    def pending(self):
+        """ Number of records available for reading """
+        self._skip_overwritten()
+        return self._ring._write_count - self._position
+
+    def read_into(self, buffer):
+        """ Copies the next record inside of buffer, which must be at least
+        slot_size bytes long. Returns the length of the record, None when
+        there are no new records """
+        ring = self._ring
+        while True:
+            self._skip_overwritten()
+            if self._position >= ring._write_count:
+                return None
+
+            index = self._position % ring._capacity
+            length = ring._lengths[index]
+            offset = index * ring._slot_size
+            buffer[:length] = ring._view[offset:offset + length]
+
+            # the writer may have reused the slot while it was being copied
+            if ring._write_started - self._position > ring._capacity:
+                continue
+            self._position += 1
+            return length
+
+    def read(self):
+        """ Returns a copy of the next record, None when there are no new
+        records """
+        buffer = bytearray(self._ring._slot_size)
+        length = self.read_into(buffer)
+        if length is None:
+            return None
+        return bytes(buffer[:length])
+
+    def __iter__(self):
+        """ Iterates over the records available right now """
+        record = self.read()
+        while record is not None:
+            yield record
+            record = self.read()
+
+    def _skip_overwritten(self):
+        """ Moves the cursor to the oldest record still available """
+        lost = self._ring._write_count - self._ring._capacity - self._position
+        if lost > 0:
+            self._overruns += lost
+            self._position += lost
@@ -0,0 +1,179 @@
+""" This module contains a rules engine reacting to the messages of the
+bus with commands.
+
+Rules are written in YAML::
+
+    rules:
+      - name: good night
+        when:
+          type: scenario
+          entity: "31"
+          scenario: "01"
+        then:
+          - "off": "33"
+          - "off": "34"
+          - lower: "40"
+
+``type`` is one of ``state``, ``command`` and ``scenario``. Besides
+``entity``, ``when`` can check the ``status`` of state and command
+messages and the ``scenario`` of scenario messages. The actions are
+``on``, ``off``, ``raise``, ``lower``, ``halt`` and ``status``, each one
+followed by the ID of the target device.
+
+Device IDs and scenarios must be quoted: YAML reads ``010`` as the number
+8. ``on`` and ``off``, which YAML reads as booleans, are accepted both
+quoted and unquoted, as status and as actions.
+
+Rules are indexed by message type and entity, the actions of each rule
+are compiled into a scsgate.scenes.Scene and sent in a single batch.
+"""
+
+import yaml
+
+from scsgate.messages import (
+    CommandMessage, ScenarioTriggeredMessage, StateMessage)
+from scsgate.scenes import Scene, SceneTask
+from scsgate.tasks import (
+    GetStatusTask, HaltRollerShutterTask, LowerRollerShutterTask,
+    RaiseRollerShutterTask, ToggleStatusTask, check_target)
+
+
+MESSAGE_TYPES = {
+    "state": StateMessage,
+    "command": CommandMessage,
+    "scenario": ScenarioTriggeredMessage,
+}
+
+# Attributes of the messages which can be checked by each type of rule
+CONDITIONS = {
+    "state": ("status",),
+    "command": ("status",),
+    "scenario": ("scenario",),
+}
+
+ACTIONS = {
+    "on": lambda target: ToggleStatusTask(target=target, toggled=True),
+    "off": lambda target: ToggleStatusTask(target=target, toggled=False),
+    "raise": lambda target: RaiseRollerShutterTask(target=target),
+    "lower": lambda target: LowerRollerShutterTask(target=target),
+    "halt": lambda target: HaltRollerShutterTask(target=target),
+    "status": lambda target: GetStatusTask(target=target),
+}
+
+
+# YAML 1.1 reads unquoted on and off as booleans
+_BOOLEANS = {True: "on", False: "off"}
+
+
+def _device_id(value):
+    """ Validates and normalizes the ID of a device written inside of a
+    rule """
+    if not isinstance(value, str):
+        raise ValueError("device ID {!r} must be quoted".format(value))
+    return check_target(value).upper()
+
+
+def _condition(key, value):
+    """ Validates and normalizes the value checked by a condition """
+    if key == "status":
+        if isinstance(value, bool):
+            value = _BOOLEANS[value]
+        if value not in ("on", "off"):
+            raise ValueError("status {!r} is not on or off".format(value))
+        return value
+    if not isinstance(value, str):
+        raise ValueError("{} {!r} must be quoted".format(key, value))
+    return value.upper()
+
+
+def compile_rule(rule, index):
+    """ Validates a rule and returns a (message class, entity, conditions,
+    scene) tuple. Raises ValueError if the rule is not valid """
+    name = rule.get("name", "rule {}".format(index))
+    try:
+        when = dict(rule["when"])
+        then = list(rule["then"])
+        kind = when.pop("type")
+        entity = _device_id(when.pop("entity"))
+        message_class = MESSAGE_TYPES[kind]
+    except (KeyError, TypeError, ValueError) as err:
+        raise ValueError("Invalid rule {}: {}".format(name, err))
+
+    for key in when:
+        if key not in CONDITIONS[kind]:
+            raise ValueError("Invalid rule {}: cannot check {} of {} "
+                             "messages".format(name, key, kind))
+    try:
+        conditions = tuple(
+            (key, _condition(key, value))
+            for key, value in sorted(when.items()))
+    except ValueError as err:
+        raise ValueError("Invalid rule {}: {}".format(name, err))
+
+    tasks = []
+    for action in then:
+        if not isinstance(action, dict) or len(action) != 1:
+            raise ValueError(
+                "Invalid rule {}: bad action {}".format(name, action))
+        (verb, target), = action.items()
+        if isinstance(verb, bool):
+            verb = _BOOLEANS[verb]
+        if verb not in ACTIONS:
+            raise ValueError(
+                "Invalid rule {}: unknown action {}".format(name, verb))
+        try:
+            tasks.append(ACTIONS[verb](_device_id(target)))
+        except ValueError as err:
+            raise ValueError("Invalid rule {}: {}".format(name, err))
+
+    return message_class, entity, conditions, Scene(name, tasks)
+
+
+class RulesEngine:
+    """ Matches the messages received by a scsgate.Reactor against the
+    rules and queues their actions """
+
+    def __init__(self, rules):
+        """ Initialize the instance
+
+        Arguments:
+        rules: list of rules, as dicts, see the module documentation
+        """
+        # (message class, entity) -> list of (conditions, scene)
+        self._table = {}
+        for index, rule in enumerate(rules):
+            message_class, entity, conditions, scene = compile_rule(
+                rule, index)
+            self._table.setdefault((message_class, entity), []).append(
+                (conditions, scene))
+        self._reactor = None
+
+    @classmethod
+    def from_yaml(cls, stream):
+        """ Creates the engine from a YAML document with a list of rules
+        under the `rules` key """
+        document = yaml.safe_load(stream) or {}
+        return cls(document.get("rules") or [])
+
+    def start(self, reactor):
+        """ Starts reacting to the messages received by the reactor """
+        self._reactor = reactor
+        reactor.add_listener(self.handle_message)
+
+    def stop(self):
+        """ Stops reacting to the messages """
+        self._reactor.remove_listener(self.handle_message)
+
+    def match(self, message):
+        """ Returns the scenes of the rules matching the message """
+        candidates = self._table.get((type(message), message.entity))
+        if not candidates:
+            return []
+        return [scene for conditions, scene in candidates
+                if all(getattr(message, key) == value
+                       for key, value in conditions)]
+
+    def handle_message(self, message):
+        """ Queues the actions of the rules matching the message """
+        for scene in self.match(message):
+            self._reactor.append_task(SceneTask(scene))
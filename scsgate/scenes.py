@@ -0,0 +1,173 @@
+""" This module contains the definition of scenes: named groups of
+commands sent to the bus in a single batch via scsgate.Reactor """
+
+import threading
+
+from scsgate.tasks import BasicTask, ExecutionError
+
+
+class Scene:
+    """ A named list of tasks, compiled once into the frames to write """
+
+    def __init__(self, name, tasks):
+        """ Initialize the instance
+
+        Arguments:
+        name: the name of the scene
+        tasks: list of tasks exposing a `command` property, like
+            ToggleStatusTask or the roller shutter tasks
+        """
+        self._name = name
+        self._members = tuple(tasks)
+        self._frames = tuple(task.command for task in self._members)
+        self._payload = b"".join(self._frames)
+
+    @property
+    def name(self):
+        """ The name of the scene """
+        return self._name
+
+    @property
+    def members(self):
+        """ The tasks making the scene """
+        return self._members
+
+    @property
+    def frames(self):
+        """ The bytes to write for each member of the scene """
+        return self._frames
+
+    @property
+    def payload(self):
+        """ The frames of all the members, ready to be written at once """
+        return self._payload
+
+    def __str__(self):
+        return "Scene: {} - {} members".format(
+            self._name, len(self._members))
+
+
+class SceneResult:
+    """ Outcome of the activation of a scene """
+
+    def __init__(self, scene, acked, failed):
+        self._scene = scene
+        self._acked = tuple(acked)
+        self._failed = tuple(failed)
+
+    @property
+    def scene(self):
+        """ The activated scene """
+        return self._scene
+
+    @property
+    def acked(self):
+        """ Tasks acknowledged by SCSGate """
+        return self._acked
+
+    @property
+    def failed(self):
+        """ Tasks refused by SCSGate """
+        return self._failed
+
+    @property
+    def success(self):
+        """ True if all the members have been acknowledged """
+        return not self._failed
+
+    def __str__(self):
+        return "SceneResult: scene {} - acked {} - failed {}".format(
+            self._scene.name, len(self._acked), len(self._failed))
+
+
+class SceneTask(BasicTask):
+    """ Activates a scene writing the frames of all its members with a
+    single write, then collects one ack per member """
+
+    def __init__(self, scene):
+        self._scene = scene
+        self._result = None
+        self._done = threading.Event()
+
+    @property
+    def cost(self):
+        """ One pacer token per member: the scene sends a command for each
+        of them """
+        return len(self._scene.members)
+
+    def execute(self, connection):
+        members = self._scene.members
+        acked = []
+        failed = []
+        try:
+            connection.serial.write(self._scene.payload)
+            for task in members:
+                if connection.reader.read(1) == b"k":
+                    acked.append(task)
+                else:
+                    failed.append(task)
+        finally:
+            # on timeout, or I/O errors, the members without an ack failed
+            failed.extend(members[len(acked) + len(failed):])
+            self._result = SceneResult(self._scene, acked, failed)
+            self._done.set()
+
+        if failed:
+            raise ExecutionError(
+                "Error while activating scene {}: {} of {} members "
+                "failed".format(
+                    self._scene.name, len(failed), len(acked) + len(failed)))
+
+    @property
+    def scene(self):
+        """ The scene activated by the task """
+        return self._scene
+
+    @property
+    def result(self):
+        """ The SceneResult, None until the task has been executed """
+        return self._result
+
+    def wait(self, timeout=None):
+        """ Waits for the execution of the task and returns its result,
+        None if the timeout expires first """
+        self._done.wait(timeout)
+        return self._result
+
+    def __str__(self):
+        return "SceneTask: scene {}".format(self._scene.name)
+
+
+class SceneRegistry:
+    """ Collection of the known scenes """
+
+    def __init__(self):
+        self._scenes = {}
+
+    def register(self, name, tasks):
+        """ Compiles and stores a scene, replacing any scene with the same
+        name. Returns the Scene instance """
+        scene = Scene(name, tasks)
+        self._scenes[name] = scene
+        return scene
+
+    def unregister(self, name):
+        """ Removes a scene """
+        del self._scenes[name]
+
+    def get(self, name):
+        """ Returns the scene with the given name """
+        return self._scenes[name]
+
+    def __contains__(self, name):
+        return name in self._scenes
+
+    def __iter__(self):
+        return iter(self._scenes.values())
+
+    def trigger(self, name, reactor):
+        """ Queues the activation of a scene on the given scsgate.Reactor.
+        Returns the SceneTask, which can be used to wait for the result """
+        task = SceneTask(self._scenes[name])
+        reactor.append_task(task)
+        return task
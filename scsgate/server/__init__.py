@@ -0,0 +1,322 @@
+""" This module implements the scs-server cli tool.
+
+scs-server owns the SCSGate device and shares it with many local clients
+over TCP or Unix sockets. Clients speak a JSON-lines protocol: each line
+sent by a client is a request, each line sent by the server is either
+the reply to a request or an event.
+
+Requests:
+
+- ``{"command": "toggle", "target": "33", "toggled": true}``
+- ``{"command": "raise" | "lower" | "halt", "target": "40"}``
+- ``{"command": "status", "target": "33"}``
+- ``{"command": "subscribe", "entities": ["33", "40"]}``, omit
+  ``entities`` to receive the messages of all the devices
+- ``{"command": "unsubscribe"}``
+- ``{"command": "snapshot"}``
+
+Events have the form ``{"type": "message", "message": {...}}``, where the
+inner dict is the one returned by SCSMessage.as_dict().
+"""
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import signal
+
+from scsgate.journal import TaskJournal
+from scsgate.messages import StateMessage
+from scsgate.reactor import Reactor
+from scsgate.tasks import (
+    GetStatusTask, HaltRollerShutterTask, LowerRollerShutterTask,
+    RaiseRollerShutterTask, ToggleStatusTask, check_target)
+
+# seconds granted to the reactor to send the pending commands on exit
+SHUTDOWN_TIMEOUT = 2.0
+
+
+def cli_opts():
+    """ Handle the command line options """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        dest="host",
+        help="Address to listen on (default: %(default)s)",)
+    parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        default=None,
+        dest="port",
+        help="TCP port to listen on (default: 8463 unless --unix-socket "
+             "is given)",)
+    parser.add_argument(
+        "-u",
+        "--unix-socket",
+        type=str,
+        required=False,
+        dest="unix_socket",
+        help="Path of the Unix socket to listen on",)
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=1000,
+        dest="queue_size",
+        help="Lines buffered for each client before dropping events "
+             "(default: %(default)s)",)
+    parser.add_argument(
+        "--journal",
+        type=str,
+        help="File where the queued commands are persisted until they "
+             "are executed, they are sent again after a restart",)
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        dest="strict",
+        help="Verify framing and checksum of the messages",)
+    parser.add_argument(
+        "-v", "--verbose",
+        action="store_true",
+        dest="verbose",
+        help="Verbose output",)
+    parser.add_argument('device')
+
+    return parser.parse_args()
+
+
+def encode(data):
+    """ Serializes a dict into a line of the protocol """
+    return json.dumps(data, separators=(",", ":")).encode() + b"\n"
+
+
+def task_from_request(request):
+    """ Returns the task matching a command request """
+    command = request["command"]
+    if command not in ("toggle", "raise", "lower", "halt", "status"):
+        raise ValueError("Unknown command {}".format(command))
+    target = check_target(request["target"])
+
+    if command == "toggle":
+        return ToggleStatusTask(
+            target=target, toggled=bool(request["toggled"]))
+    elif command == "raise":
+        return RaiseRollerShutterTask(target=target)
+    elif command == "lower":
+        return LowerRollerShutterTask(target=target)
+    elif command == "halt":
+        return HaltRollerShutterTask(target=target)
+    return GetStatusTask(target=target)
+
+
+class Client:
+    """ A client connected to the server """
+
+    def __init__(self, writer, queue_size):
+        self._writer = writer
+        self._queue_size = queue_size
+        # (line, True for events) tuples, in order of sending. Only the
+        # events are bounded: the replies to the requests are never
+        # dropped
+        self._queue = asyncio.Queue()
+        self._events = 0
+        # None when not subscribed, an empty set when subscribed to all
+        # the entities
+        self._entities = None
+        self.dropped = 0
+
+    def subscribe(self, entities):
+        """ Receive the messages of the given entities, of all of them
+        when entities is empty """
+        self._entities = frozenset(entities)
+
+    def unsubscribe(self):
+        """ Stop receiving messages """
+        self._entities = None
+
+    def wants(self, entity):
+        """ True if the client is interested in the entity """
+        if self._entities is None:
+            return False
+        return not self._entities or entity in self._entities
+
+    def send(self, line):
+        """ Queues an event, dropping it if the client is too slow """
+        if self._events >= self._queue_size:
+            self.dropped += 1
+            return
+        self._events += 1
+        self._queue.put_nowait((line, True))
+
+    def reply(self, line):
+        """ Queues the reply to a request, it is never dropped """
+        self._queue.put_nowait((line, False))
+
+    def close(self):
+        """ Closes the connection with the client """
+        self._writer.close()
+
+    async def flush(self):
+        """ Writes the queued lines to the socket, draining it only when
+        the queue is empty to batch writes """
+        while True:
+            line, event = await self._queue.get()
+            if event:
+                self._events -= 1
+            self._writer.write(line)
+            if self._queue.empty():
+                await self._writer.drain()
+
+
+class Server:
+    """ Multiplexes one SCSGate device to many clients """
+
+    def __init__(self, options):
+        self._options = options
+
+        log_level = logging.INFO
+        if options.verbose:
+            log_level = logging.DEBUG
+        logging.basicConfig(
+            format='%(asctime)s - %(levelname)s: %(message)s',
+            level=log_level)
+
+        self._clients = set()
+        # entity ID -> last known status
+        self._states = {}
+        self._loop = None
+        self._reactor = None
+
+    def start(self):
+        """ Serves the clients until SIGINT or SIGTERM are received """
+        asyncio.run(self._serve())
+
+    def _connect(self):
+        """ Opens the connection with the SCSGate device """
+        from scsgate.connection import Connection
+        return Connection(device=self._options.device, logger=logging)
+
+    async def _serve(self):
+        """ Starts the reactor and the listening sockets """
+        self._loop = asyncio.get_running_loop()
+        journal = None
+        if self._options.journal:
+            journal = TaskJournal(self._options.journal, logger=logging)
+        self._reactor = Reactor(
+            connection=self._connect(),
+            handle_message=self._handle_message,
+            logger=logging,
+            connection_factory=self._connect,
+            strict=self._options.strict,
+            journal=journal)
+
+        servers = []
+        if self._options.unix_socket:
+            servers.append(await asyncio.start_unix_server(
+                self._handle_client, path=self._options.unix_socket))
+        if self._options.port or not self._options.unix_socket:
+            servers.append(await asyncio.start_server(
+                self._handle_client,
+                host=self._options.host,
+                port=self._options.port or 8463))
+
+        self._reactor.start()
+        logging.info("scs-server ready")
+
+        terminate = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            self._loop.add_signal_handler(signum, terminate.set)
+        await terminate.wait()
+
+        for server in servers:
+            server.close()
+        for client in list(self._clients):
+            client.close()
+        for server in servers:
+            await server.wait_closed()
+        # the commands already accepted are sent before closing the port
+        report = await self._loop.run_in_executor(
+            None, functools.partial(
+                self._reactor.stop, timeout=SHUTDOWN_TIMEOUT, drain=True))
+        logging.info("%s", report)
+        if journal is not None:
+            # the dropped commands are left in the journal
+            journal.close()
+
+    def _handle_message(self, message):
+        """ Invoked by the reactor thread, hands the message over to the
+        event loop without doing any further work """
+        self._loop.call_soon_threadsafe(self._broadcast, message)
+
+    def _broadcast(self, message):
+        """ Sends the message to the interested clients. The message is
+        serialized at most once """
+        if isinstance(message, StateMessage):
+            self._states[message.entity] = message.status
+
+        line = None
+        for client in self._clients:
+            if client.wants(message.entity):
+                if line is None:
+                    line = encode(
+                        {"type": "message", "message": message.as_dict()})
+                client.send(line)
+
+    async def _handle_client(self, reader, writer):
+        """ Serves a single client """
+        client = Client(writer, self._options.queue_size)
+        self._clients.add(client)
+        flusher = asyncio.ensure_future(client.flush())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                client.reply(encode(self._handle_request(client, line)))
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(client)
+            # a flusher which already failed cannot be cancelled, its
+            # error has to be retrieved
+            if not flusher.cancel() and not flusher.cancelled() and \
+               flusher.exception() is not None:
+                logging.info(
+                    "Client disconnected: {}".format(flusher.exception()))
+            client.close()
+            if client.dropped:
+                logging.warning(
+                    "Client dropped {} events".format(client.dropped))
+
+    def _handle_request(self, client, line):
+        """ Executes a request and returns the reply """
+        try:
+            request = json.loads(line)
+            command = request["command"]
+            if command == "subscribe":
+                entities = request.get("entities") or []
+                if not isinstance(entities, list):
+                    raise ValueError("entities must be a list")
+                client.subscribe(
+                    check_target(entity).upper() for entity in entities)
+            elif command == "unsubscribe":
+                client.unsubscribe()
+            elif command == "snapshot":
+                return {"type": "snapshot", "states": dict(self._states)}
+            else:
+                self._reactor.append_task(task_from_request(request))
+        except (ValueError, KeyError, TypeError) as err:
+            return {"type": "error", "error": str(err)}
+
+        return {"type": "ok"}
+
+
+def main():
+    """ Entry point of the scs-server cli tool """
+
+    options = cli_opts()
+    server = Server(options)
+    server.start()
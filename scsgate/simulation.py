@@ -0,0 +1,245 @@
+""" This module contains a deterministic simulation of SCSGate, useful to
+test and benchmark scsgate.Reactor.
+
+Time is virtual: it advances only when the simulated serial port is
+used, by the latencies given to the simulation. Events scheduled with
+Simulation.at, like messages appearing on the bus or a call to
+Reactor.stop, fire while the reactor is waiting for the port. The
+reactor runs in the calling thread, so the same script always produces
+the same results.
+"""
+
+import heapq
+import itertools
+
+from scsgate.messages import compose_telegram
+from scsgate.reactor import Reactor
+from scsgate.reader import BufferedReader
+
+
+class VirtualClock:
+    """ Clock advancing only when told to, firing the scheduled events """
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._events = []
+        self._counter = itertools.count()
+
+    def __call__(self):
+        """ Returns the current time, like time.monotonic """
+        return self._now
+
+    def call_at(self, when, callback):
+        """ Schedules the invocation of callback at the given time """
+        heapq.heappush(self._events, (when, next(self._counter), callback))
+
+    def advance(self, seconds):
+        """ Moves the time forward, firing the events met on the way """
+        target = self._now + seconds
+        while self._events and self._events[0][0] <= target:
+            when, _, callback = heapq.heappop(self._events)
+            self._now = max(self._now, when)
+            callback()
+        self._now = target
+
+    def sleep(self, seconds):
+        """ Replacement of time.sleep """
+        self.advance(seconds)
+
+
+class SimulatedSerial:
+    """ Serial port attached to a simulated SCSGate.
+
+    Every write and every read costs some virtual time. A read finding no
+    data waits for the timeout of the port, like pyserial does. The
+    gateway acknowledges the commands, unless told to refuse them,
+    answers to status requests and, when echo is enabled, emits the new
+    state of the devices switched with @w. A single write can carry many
+    commands, like the ones of a scene """
+
+    def __init__(self, clock, write_latency=0.0005, read_latency=0.001,
+                 timeout=0.05, echo=True):
+        self._clock = clock
+        self._write_latency = write_latency
+        self._read_latency = read_latency
+        self._timeout = timeout
+        self._echo = echo
+
+        self._output = bytearray()
+        # telegrams waiting to be fetched with @r
+        self._bus = []
+        # entity ID -> "00" (on) or "01" (off)
+        self._states = {}
+        self._stalled_until = None
+        # (command, answer) of the commands to refuse, once each
+        self._refused = []
+        # (time, bytes) for every write
+        self.log = []
+
+    def inject(self, telegram):
+        """ Makes a telegram available on the bus """
+        self._bus.append(telegram)
+
+    def stall(self, duration):
+        """ Makes the gateway silent for the given number of seconds """
+        self._stalled_until = self._clock() + duration
+
+    def refuse(self, command, answer=b"E"):
+        """ Makes the gateway answer the next occurrence of a command
+        with an error, or not answer at all when answer is empty """
+        self._refused.append((command, answer))
+
+    @property
+    def in_waiting(self):
+        if self._stalled():
+            return 0
+        return len(self._output)
+
+    def write(self, data):
+        self.log.append((self._clock(), bytes(data)))
+        self._clock.advance(self._write_latency)
+        for command in bytes(data).split(b"@")[1:]:
+            self._execute(b"@" + command)
+        return len(data)
+
+    def read(self, size=1):
+        if self._stalled() or not self._output:
+            self._clock.advance(self._timeout)
+            return b""
+        self._clock.advance(self._read_latency)
+        data = bytes(self._output[:size])
+        del self._output[:size]
+        return data
+
+    def close(self):
+        pass
+
+    def _stalled(self):
+        """ True while the gateway is silent """
+        return self._stalled_until is not None and \
+            self._clock() < self._stalled_until
+
+    def _execute(self, command):
+        """ Answers to a single command """
+        if command == b"@r":
+            self._fetch()
+        elif command.startswith(b"@w"):
+            self._set_status(command)
+        elif self._acknowledge(command) and command.startswith(b"@W7"):
+            self._emit_state(command[5:7].decode())
+
+    def _acknowledge(self, command):
+        """ Answers to a command with k, unless it has to be refused.
+        Returns True if the command has been accepted """
+        for refusal in self._refused:
+            if refusal[0] == command:
+                self._refused.remove(refusal)
+                self._output += refusal[1]
+                return False
+        self._output += b"k"
+        return True
+
+    def _fetch(self):
+        """ Answers to @r with the oldest telegram of the bus """
+        if not self._bus:
+            self._output += b"0"
+            return
+        telegram = self._bus.pop(0)
+        self._output += "{:X}".format(len(telegram) // 2).encode()
+        self._output += telegram
+
+    def _set_status(self, data):
+        """ Executes a @w command """
+        action = data[2:3].decode()
+        target = data[3:].decode()
+        if not self._acknowledge(data):
+            return
+        if action in ("0", "1"):
+            self._states[target] = "0" + action
+            if self._echo:
+                self._emit_state(target)
+
+    def _emit_state(self, target):
+        """ Queues the state message of a device on the bus """
+        status = self._states.get(target, "01")
+        self._bus.append(compose_telegram([
+            b"B8", target.encode(), b"12", status.encode()]))
+
+
+class SimulatedConnection:
+    """ Drop-in replacement of scsgate.Connection """
+
+    def __init__(self, serial, clock, read_timeout=5.0):
+        self._serial = serial
+        self._reader = BufferedReader(
+            serial, timeout=read_timeout, clock=clock)
+        self.closed_at = None
+        self._clock = clock
+
+    @property
+    def serial(self):
+        """ Returns the SimulatedSerial instance """
+        return self._serial
+
+    @property
+    def reader(self):
+        """ Returns the scsgate.reader.BufferedReader """
+        return self._reader
+
+    def close(self):
+        """ Records the time of the closure """
+        self.closed_at = self._clock()
+
+
+class Simulation:
+    """ A scripted run of a scsgate.Reactor against a simulated SCSGate """
+
+    def __init__(self, read_timeout=5.0, **serial_options):
+        """ Initialize the instance
+
+        Arguments:
+        read_timeout: default deadline of the reads of the reactor
+        serial_options: options of SimulatedSerial, like the latencies
+        """
+        self.clock = VirtualClock()
+        self.serial = SimulatedSerial(self.clock, **serial_options)
+        self.connection = SimulatedConnection(
+            self.serial, self.clock, read_timeout=read_timeout)
+        # (time, message) for every message delivered by the reactor
+        self.messages = []
+        self.stop_requested_at = None
+
+    def reactor(self, **options):
+        """ Creates a Reactor using the simulated connection and clock.
+        The messages it delivers are recorded in self.messages """
+        return Reactor(
+            connection=self.connection,
+            handle_message=self._record,
+            clock=self.clock,
+            sleep=self.clock.sleep,
+            **options)
+
+    def at(self, when, callback):
+        """ Schedules a callback at the given virtual time """
+        self.clock.call_at(when, callback)
+
+    def inject_at(self, when, telegram):
+        """ Makes a telegram appear on the bus at the given time """
+        self.at(when, lambda: self.serial.inject(telegram))
+
+    def run(self, reactor, until, **stop_options):
+        """ Runs the reactor until it is stopped at the given time, with
+        the given options of Reactor.stop. Returns the stop latency: the
+        virtual time elapsed between the call to stop() and the closure
+        of the connection """
+        def stop():
+            self.stop_requested_at = self.clock()
+            reactor.stop(**stop_options)
+
+        self.at(until, stop)
+        reactor.run()
+        return self.connection.closed_at - self.stop_requested_at
+
+    def _record(self, message):
+        """ Callback of the reactor """
+        self.messages.append((self.clock(), message))
@@ -1,7 +1,10 @@
 """ This module contains all the possible messages to send via
 scsgate.Reactor """
 
-from scsgate.messages import compose_telegram, parse, StateMessage
+import functools
+
+from scsgate.messages import (
+    compose_telegram, parse, InvalidMessage, StateMessage)
 
 
 class ExecutionError(BaseException):
@@ -9,9 +12,23 @@ class ExecutionError(BaseException):
     pass
 
 
+def check_target(target):
+    """ Raises ValueError unless target is a device ID: two hex digits.
+    To be used on the IDs coming from untrusted sources, which would
+    otherwise be written to SCSGate as they are """
+    if not isinstance(target, str) or len(target) != 2 or \
+       target.strip("0123456789ABCDEFabcdef"):
+        raise ValueError("Invalid device ID {!r}".format(target))
+    return target
+
+
 class BasicTask:
     """ Basic task, not to be used directly """
 
+    # Number of commands the task sends to the bus, the tokens it takes
+    # from the pacer of scsgate.Reactor
+    cost = 1
+
     def execute(self, connection):
         """ Method to be implemented by all subclasses """
         raise NotImplementedError()
@@ -21,17 +38,30 @@ class MonitorTask(BasicTask):
     """ Read the buffer and invokes the notification endpoint if there's
         a relevant message """
 
-    def __init__(self, notification_endpoint):
+    def __init__(self, notification_endpoint, strict=False,
+                 raw_endpoint=None):
+        """ Initialize the instance
+
+        Arguments:
+        notification_endpoint: callback invoked with every message
+        strict: validate framing and checksum of the telegrams, invalid
+            ones are counted and dropped
+        raw_endpoint: optional callback invoked with the raw telegram of
+            every notified message, like MessageRing.append
+        """
         self._notification_endpoint = notification_endpoint
+        self._strict = strict
+        self._raw_endpoint = raw_endpoint
         self._last_raw_state_message = None
 
     def execute(self, connection):
         connection.serial.write(b"@r")
-        length = int(connection.serial.read(), 16)
-        if length == 0:
+        data = connection.reader.read_frame()
+        if not data:
+            return
+        message = parse(data, strict=self._strict)
+        if isinstance(message, InvalidMessage):
             return
-        data = connection.serial.read(length * 2)
-        message = parse(data)
         # Filter duplicated state messages. The filtering feature
         # of SCSGate is buggy and causes @r to always return 0 available
         # messages
@@ -40,32 +70,92 @@ class MonitorTask(BasicTask):
                 return
             else:
                 self._last_raw_state_message = data
+        if self._raw_endpoint is not None:
+            self._raw_endpoint(data)
         self._notification_endpoint(message)
 
+    def reset(self):
+        """ Forgets the last state message, the next one is always
+        notified """
+        self._last_raw_state_message = None
+
     def __str__(self):
         return "Monitor Task"
 
 
+@functools.lru_cache(maxsize=1024)
+def set_status_command(action, target):
+    """ Returns the bytes of the @w command performing the action on the
+    target. Tasks with the same action and target share them """
+    return str.encode("@w{action}{target}".format(
+        action=action,
+        target=target))
+
+
+@functools.lru_cache(maxsize=1024)
+def get_status_command(target):
+    """ Returns the bytes of the command requesting the status of the
+    target. Tasks with the same target share them """
+    return b"@W7" + compose_telegram([
+        str.encode(target),
+        b"00",
+        b"15",
+        b"00"])
+
+
 class SetStatusTask(BasicTask):
-    """ Generic task to request a status change. To not be used directly """
+    """ Generic task to request a status change. To not be used directly.
+
+    Tasks are values: they are not changed once created, and tasks of the
+    same type with the same target and action are equal """
 
     def __init__(self, target, action):
         self._target = target
         self._action = action
+        self._command = set_status_command(action, target)
+        self._key = (type(self), str(action), target)
+        self._hash = hash(self._key)
+        # formatted the first time the task is printed
+        self._description = None
+
+    @property
+    def target(self):
+        """ The ID of the device the task is about """
+        return self._target
+
+    @property
+    def action(self):
+        """ The action requested to the device """
+        return self._action
+
+    @property
+    def command(self):
+        """ The bytes written to SCSGate to execute the task """
+        return self._command
 
     def execute(self, connection):
-        command = "@w{action}{target}".format(
-            action=self._action,
-            target=self._target)
-
-        connection.serial.write(str.encode(command))
-        ret = connection.serial.read()
+        connection.serial.write(self._command)
+        ret = connection.reader.read(1)
         if ret != b'k':
             raise ExecutionError(
                 "Error while setting status. Command {}, got {}".format(
-                    command, ret))
+                    self._command, ret))
+
+    def __eq__(self, other):
+        if not isinstance(other, SetStatusTask):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self):
+        return self._hash
 
     def __str__(self):
+        if self._description is None:
+            self._description = self._describe()
+        return self._description
+
+    def _describe(self):
+        """ Formats the description returned by __str__ """
         return "SetStatusTask: target {} - action {}".format(
             self._target, self._action)
 
@@ -84,7 +174,12 @@ class ToggleStatusTask(SetStatusTask):
             target=target,
             action=action)
 
-    def __str__(self):
+    @property
+    def toggled(self):
+        """ True if the task turns the device on """
+        return self._toggled
+
+    def _describe(self):
         return "ToggleStatusTask: target {} - toggled {}".format(
             self._target, self._toggled)
 
@@ -98,7 +193,7 @@ class RaiseRollerShutterTask(SetStatusTask):
             target=target,
             action=8)
 
-    def __str__(self):
+    def _describe(self):
         return "RaiseRollerShutterTask: target {}".format(
             self._target)
 
@@ -112,7 +207,7 @@ class LowerRollerShutterTask(SetStatusTask):
             target=target,
             action=9)
 
-    def __str__(self):
+    def _describe(self):
         return "LowerRollerShutterTask: target {}".format(
             self._target)
 
@@ -126,30 +221,50 @@ class HaltRollerShutterTask(SetStatusTask):
             target=target,
             action="A")
 
-    def __str__(self):
+    def _describe(self):
         return "HaltRollerShutterTask: target {}".format(
             self._target)
 
 
 class GetStatusTask(BasicTask):
-    """ Requests the current status of a device """
+    """ Requests the current status of a device. Like SetStatusTask, it is
+    a value """
 
     def __init__(self, target):
         self._target = target
+        self._command = get_status_command(target)
+        self._key = (type(self), target)
+        self._hash = hash(self._key)
+        self._description = None
+
+    @property
+    def target(self):
+        """ The ID of the device the task is about """
+        return self._target
+
+    @property
+    def command(self):
+        """ The bytes written to SCSGate to execute the task """
+        return self._command
 
     def execute(self, connection):
-        command = b"@W7" + compose_telegram([
-            str.encode(self._target),
-            b"00",
-            b"15",
-            b"00"])
-        connection.serial.write(command)
-        ret = connection.serial.read()
+        connection.serial.write(self._command)
+        ret = connection.reader.read(1)
         if ret != b'k':
             raise ExecutionError(
                 "Error while requesting status. Command {}, got {}".format(
-                    command, ret))
+                    self._command, ret))
+
+    def __eq__(self, other):
+        if not isinstance(other, GetStatusTask):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self):
+        return self._hash
 
     def __str__(self):
-        return "GetStatusTask: target {}".format(
-            self._target)
+        if self._description is None:
+            self._description = "GetStatusTask: target {}".format(
+                self._target)
+        return self._description
@@ -54,12 +54,15 @@ setup(
 
         # Specify the Python versions you support here.
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.2',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
 
+    # asyncio.run, queue.SimpleQueue and multiprocessing.shared_memory
+    python_requires='>=3.8',
+
     # What does your project relate to?
     keywords='scsgate home-automation development',
 
@@ -80,6 +83,7 @@ setup(
     extras_require={
         'dev': [],
         'test': ['nosetest'],
+        'mqtt': ['paho-mqtt'],
     },
 
     # To provide executable scripts, use entry points in preference to the
@@ -88,6 +92,8 @@ setup(
     entry_points={
         'console_scripts': [
             'scs-monitor=scsgate.monitor:main',
+            'scs-server=scsgate.server:main',
+            'scs-mqtt=scsgate.mqtt:main',
         ],
     },
 )
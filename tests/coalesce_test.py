@@ -0,0 +1,47 @@
+# Test the coalescing of state messages
+
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate import messages  # NOQA E402
+from scsgate.coalesce import StateCoalescer  # NOQA E402
+
+
+class TestStateCoalescer(unittest.TestCase):
+    """ Test StateCoalescer """
+
+    def setUp(self):
+        self.delivered = []
+        self.coalescer = StateCoalescer(self.delivered.append, window=1.0)
+
+    def test_last_state_wins(self):
+        on = messages.parse(b"A8B833120098A3")
+        off = messages.parse(b"A8B833120198A3")
+        other = messages.parse(b"A8B834120198A3")
+
+        self.coalescer.handle_message(on, now=0)
+        self.coalescer.handle_message(other, now=0.5)
+        self.coalescer.handle_message(off, now=0.9)
+        self.coalescer.flush(now=0.95)
+        self.assertEqual(self.delivered, [])
+
+        self.coalescer.flush(now=1.0)
+        self.assertEqual(self.delivered, [off])
+        self.coalescer.flush(now=1.5)
+        self.assertEqual(self.delivered, [off, other])
+        self.assertEqual(self.coalescer.coalesced, 1)
+
+    def test_other_messages_are_not_held(self):
+        command = messages.parse(b"A83300120021A3")
+        state = messages.parse(b"A8B833120098A3")
+        self.coalescer.handle_message(state, now=0)
+        self.coalescer.handle_message(command, now=0)
+        self.assertEqual(self.delivered, [command])
+
+        self.coalescer.flush_all()
+        self.assertEqual(self.delivered, [command, state])
@@ -0,0 +1,145 @@
+# Test the confirmation of the commands
+
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate import messages  # NOQA E402
+from scsgate.confirm import CommandVerifier  # NOQA E402
+from scsgate.reader import BufferedReader  # NOQA E402
+from scsgate.tasks import GetStatusTask, ToggleStatusTask  # NOQA E402
+
+
+STATE_ON = messages.parse(b"A8B833120099A3")
+STATE_OFF = messages.parse(b"A8B833120198A3")
+
+
+class FakeSerial:
+    """ Serial port acknowledging everything """
+
+    def __init__(self):
+        self.written = []
+
+    @property
+    def in_waiting(self):
+        return 1
+
+    def write(self, data):
+        self.written.append(data)
+
+    def read(self, size=1):
+        return b"k"
+
+
+class FakeConnection:
+    """ Connection wrapping a FakeSerial """
+
+    def __init__(self):
+        self.serial = FakeSerial()
+        self.reader = BufferedReader(self.serial)
+
+
+class FakeReactor:
+    """ Collects the tasks, they are executed by the tests """
+
+    def __init__(self):
+        self.tasks = []
+        self.scheduled = []
+        self.listeners = []
+        self.connection = FakeConnection()
+
+    def append_task(self, task):
+        self.tasks.append(task)
+
+    def schedule_task(self, task, delay):
+        self.scheduled.append(task)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def run_queued(self):
+        tasks, self.tasks = self.tasks, []
+        for task in tasks:
+            task.execute(self.connection)
+
+    def expire_deadlines(self):
+        scheduled, self.scheduled = self.scheduled, []
+        for task in scheduled:
+            task.execute(self.connection)
+
+
+class TestCommandVerifier(unittest.TestCase):
+    """ Test CommandVerifier """
+
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.verifier = CommandVerifier(self.reactor, retries=1)
+
+    def test_confirmed_by_echo(self):
+        pending = self.verifier.submit(
+            ToggleStatusTask(target="33", toggled=True))
+        self.reactor.run_queued()
+        self.verifier.handle_message(STATE_ON)
+
+        self.assertTrue(pending.done)
+        self.assertTrue(pending.confirmed)
+        self.reactor.expire_deadlines()
+        self.assertEqual(self.reactor.tasks, [])
+        self.assertEqual(self.reactor.connection.serial.written, [b"@w033"])
+
+    def test_probe_then_retry(self):
+        pending = self.verifier.submit(
+            ToggleStatusTask(target="33", toggled=True))
+        self.reactor.run_queued()
+
+        # no echo: the device is probed
+        self.reactor.expire_deadlines()
+        self.assertIsInstance(self.reactor.tasks[0], GetStatusTask)
+        self.reactor.run_queued()
+
+        # the device is still off: the command is sent again
+        self.verifier.handle_message(STATE_OFF)
+        self.reactor.run_queued()
+        self.verifier.handle_message(STATE_ON)
+
+        self.assertTrue(pending.wait(0))
+        self.assertEqual(pending.attempts, 2)
+        self.assertEqual(
+            self.reactor.connection.serial.written,
+            [b"@w033", b"@W7A83300150026A3", b"@w033"])
+
+    def test_give_up(self):
+        verifier = CommandVerifier(self.reactor, retries=0)
+        pending = verifier.submit(
+            ToggleStatusTask(target="33", toggled=False))
+        self.reactor.run_queued()
+        self.reactor.expire_deadlines()
+        self.reactor.run_queued()
+        self.reactor.expire_deadlines()
+
+        self.assertTrue(pending.done)
+        self.assertFalse(pending.confirmed)
+
+    def test_superseded(self):
+        first = self.verifier.submit(
+            ToggleStatusTask(target="33", toggled=True))
+        second = self.verifier.submit(
+            ToggleStatusTask(target="33", toggled=False))
+        self.assertTrue(first.done)
+        self.assertFalse(first.confirmed)
+        self.assertFalse(second.done)
+
+    def test_state_before_sending_does_not_confirm(self):
+        pending = self.verifier.submit(
+            ToggleStatusTask(target="33", toggled=True))
+        # a stale echo, received while the command is still queued
+        self.verifier.handle_message(STATE_ON)
+        self.assertFalse(pending.done)
+
+        self.reactor.run_queued()
+        self.verifier.handle_message(STATE_ON)
+        self.assertTrue(pending.confirmed)
@@ -0,0 +1,73 @@
+# Test the health monitor
+
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate import health  # NOQA E402
+from scsgate.reader import ReadTimeout  # NOQA E402
+from scsgate.simulation import Simulation  # NOQA E402
+from scsgate.tasks import ExecutionError  # NOQA E402
+
+
+class TestHealthMonitor(unittest.TestCase):
+    """ Test HealthMonitor """
+
+    def test_percentiles(self):
+        samples = list(range(1, 101))
+        self.assertEqual(
+            health.percentiles(samples),
+            {"p50": 50, "p90": 90, "p99": 99})
+        self.assertEqual(health.percentiles([]), {})
+
+    def test_liveness_and_readiness(self):
+        monitor = health.HealthMonitor(
+            ping_interval=10, liveness_timeout=5, max_ping_latency=0.5)
+        monitor.heartbeat(now=100)
+        self.assertTrue(monitor.live(now=104))
+        self.assertFalse(monitor.ready(now=104))
+
+        monitor.record_ping(0.1, now=104)
+        self.assertTrue(monitor.ready(now=104))
+        # the reactor loop is stuck
+        self.assertFalse(monitor.live(now=106))
+        self.assertFalse(monitor.ready(now=106))
+
+        monitor.heartbeat(now=125)
+        self.assertTrue(monitor.live(now=125))
+        # the last ping is too old
+        self.assertFalse(monitor.ready(now=125))
+
+    def test_ping_task(self):
+        sim = Simulation(write_latency=0.002, read_latency=0.003)
+        monitor = health.HealthMonitor(clock=sim.clock)
+        task = health.PingTask(monitor)
+        task.execute(sim.connection)
+        self.assertTrue(monitor.ready())
+        self.assertAlmostEqual(monitor.status()["ping"]["p50"], 0.005)
+
+        sim.serial.refuse(b"@MA")
+        with self.assertRaises(ExecutionError):
+            task.execute(sim.connection)
+        self.assertFalse(monitor.ready())
+        self.assertEqual(monitor.status()["ping_failures"], 1)
+        self.assertEqual([data for _, data in sim.serial.log],
+                         [b"@MA", b"@MA"])
+
+    def test_ping_timeout(self):
+        sim = Simulation(read_timeout=0.2)
+        monitor = health.HealthMonitor(clock=sim.clock)
+        task = health.PingTask(monitor)
+        task.execute(sim.connection)
+        self.assertTrue(monitor.ready())
+
+        # a wedged gateway
+        sim.serial.stall(1.0)
+        with self.assertRaises(ReadTimeout):
+            task.execute(sim.connection)
+        self.assertFalse(monitor.ready())
+        self.assertEqual(monitor.status()["ping_failures"], 1)
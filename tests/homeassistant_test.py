@@ -0,0 +1,181 @@
+# Test the generation of the home assistant configuration
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import yaml
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate.messages import parse  # NOQA E402
+from scsgate.homeassistant import (  # NOQA E402
+    HomeAssistantConfig, YamlLoader, device_kind)
+from scsgate.registry import DeviceRegistry  # NOQA E402
+
+EXISTING = """\
+scsgate:
+  device: /dev/ttyUSB0
+devices:
+  hall:
+    name: Hall
+    scs_id: '31'
+light:
+- platform: hue
+- platform: scsgate
+  devices:
+    hall:
+      name: Hall
+      scs_id: '31'
+"""
+
+TAGGED = """\
+http:
+  api_password: !secret http_password
+switch: !include switches.yaml
+sensor: !include_dir_merge_list sensors/
+devices:
+  hall:
+    name: Hall
+    scs_id: '31'
+"""
+
+
+class FakeClock:
+    """ Clock set by the tests """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestHomeAssistantConfig(unittest.TestCase):
+    """ Test the HomeAssistantConfig class """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "scsgate.yaml")
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open(self):
+        return HomeAssistantConfig(self.path, delay=1.0, max_delay=3.0,
+                                   clock=self.clock)
+
+    def read(self):
+        with open(self.path) as conf:
+            return yaml.safe_load(conf)
+
+    def read_tagged(self):
+        with open(self.path) as conf:
+            return yaml.load(conf, Loader=YamlLoader)
+
+    def test_device_kind(self):
+        self.assertEqual(device_kind(parse(b"A8B83112009BA3")), "light")
+        self.assertEqual(device_kind(parse(b"A8400012085AA3")), "cover")
+        self.assertEqual(device_kind(parse(b"A83100140326A3")), "scenario")
+        self.assertIsNone(device_kind(parse(b"A83100153014A3")))
+
+    def test_merge_with_existing_file(self):
+        with open(self.path, "w") as conf:
+            conf.write(EXISTING)
+        config = self.open()
+        self.assertEqual(list(config.devices()), [("31", "hall", "Hall")])
+        self.assertEqual(config.kind("31"), "light")
+
+        config.observe(parse(b"A8400012085AA3"))
+        config.add_device("40", "kitchen_shutter", "Kitchen shutter")
+        config.save()
+
+        document = self.read()
+        self.assertEqual(document["scsgate"], {"device": "/dev/ttyUSB0"})
+        self.assertEqual(sorted(document["devices"]),
+                         ["hall", "kitchen_shutter"])
+        self.assertEqual(document["light"][0], {"platform": "hue"})
+        self.assertEqual(list(document["light"][1]["devices"]), ["hall"])
+        self.assertEqual(document["cover"], [{
+            "platform": "scsgate",
+            "devices": {"kitchen_shutter": {
+                "name": "Kitchen shutter", "scs_id": "40"}}}])
+
+        registry = DeviceRegistry()
+        registry.load(self.path)
+        self.assertEqual(registry.entities, ["31", "40"])
+
+    def test_writes_are_debounced(self):
+        config = self.open()
+        config.add_device("31", "hall", "Hall")
+        self.clock.now = 0.5
+        config.add_device("32", "kitchen", "Kitchen")
+        self.assertFalse(config.flush())
+        self.clock.now = 1.4
+        self.assertFalse(config.flush())
+        self.clock.now = 1.5
+        self.assertTrue(config.flush())
+        self.assertEqual(config.writes, 1)
+        self.assertFalse(config.dirty)
+        self.assertEqual(len(self.read()["devices"]), 2)
+
+        # a steady stream of changes is written after max_delay
+        for step in range(10):
+            self.clock.now = 2 + step * 0.5
+            config.add_device("4{}".format(step), "dev{}".format(step), "")
+            config.flush()
+        self.assertEqual(config.writes, 2)
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_device_moves_to_more_specific_platform(self):
+        config = self.open()
+        config.observe(parse(b"A8B8401200EAA3"))
+        config.add_device("40", "shutter", "Shutter")
+        config.save()
+        self.assertIn("shutter", self.read()["light"][0]["devices"])
+
+        config.observe(parse(b"A8400012085AA3"))
+        config.observe(parse(b"A8B8401200EAA3"))
+        config.save()
+        document = self.read()
+        self.assertEqual(document["light"][0]["devices"], {})
+        self.assertIn("shutter", document["cover"][0]["devices"])
+        self.assertEqual(config.kind("40"), "cover")
+
+    def test_tags_are_preserved(self):
+        with open(self.path, "w") as conf:
+            conf.write(TAGGED)
+        config = self.open()
+        self.assertEqual(list(config.devices()), [("31", "hall", "Hall")])
+
+        # scenario switches belong to the switch section, kept in another
+        # file
+        config.observe(parse(b"A83100140326A3"))
+        config.observe(parse(b"A8B8401200EAA3"))
+        config.add_device("40", "kitchen", "Kitchen")
+        config.save()
+
+        with open(self.path) as conf:
+            text = conf.read()
+        self.assertIn("api_password: !secret http_password\n", text)
+        self.assertIn("switch: !include switches.yaml\n", text)
+        self.assertIn("sensor: !include_dir_merge_list sensors/\n", text)
+        self.assertEqual(config.kind("31"), "scenario")
+        self.assertIn("kitchen", self.read_tagged()["light"][0]["devices"])
+
+        registry = DeviceRegistry()
+        registry.load(self.path)
+        self.assertEqual(registry.entities, ["31", "40"])
+
+    def test_invalid_file_is_not_touched(self):
+        with open(self.path, "w") as conf:
+            conf.write("devices: [unterminated\n")
+        with self.assertRaises(ValueError):
+            self.open()
+        with open(self.path) as conf:
+            self.assertEqual(conf.read(), "devices: [unterminated\n")
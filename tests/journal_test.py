@@ -0,0 +1,153 @@
+# Test the persistence of the queued tasks
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate.journal import (  # NOQA E402
+    TaskJournal, build_task, describe_task)
+from scsgate.simulation import Simulation  # NOQA E402
+from scsgate.tasks import (  # NOQA E402
+    GetStatusTask, HaltRollerShutterTask, SetStatusTask, ToggleStatusTask)
+
+
+class FakeClock:
+    """ Wall clock set by the tests """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestTaskJournal(unittest.TestCase):
+    """ Test the TaskJournal class """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "tasks.journal")
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open(self, **options):
+        return TaskJournal(self.path, clock=self.clock, **options)
+
+    def test_descriptors(self):
+        for task in (ToggleStatusTask(target="33", toggled=True),
+                     HaltRollerShutterTask(target="40"),
+                     SetStatusTask(target="41", action=3),
+                     GetStatusTask(target="33")):
+            copy = build_task(describe_task(task))
+            self.assertIs(type(copy), type(task))
+            self.assertEqual(copy.command, task.command)
+        self.assertIsNone(describe_task(object()))
+        with self.assertRaises(ValueError):
+            build_task({"type": "MonitorTask"})
+
+    def test_pending_tasks_survive_restart(self):
+        journal = self.open()
+        first = ToggleStatusTask(target="33", toggled=True)
+        second = HaltRollerShutterTask(target="40")
+        self.assertTrue(journal.append(first))
+        self.assertTrue(journal.append(second))
+        self.assertFalse(journal.append(object()))
+        journal.complete(first)
+        journal.close()
+
+        journal = self.open()
+        pending = journal.pending()
+        journal.close()
+        self.assertEqual([str(task) for task in pending], [str(second)])
+
+    def test_complete_by_identity(self):
+        journal = self.open()
+        task = GetStatusTask(target="33")
+        journal.append(task)
+        journal.append(task)
+        # an equal task, queued once
+        journal.append(GetStatusTask(target="33"))
+        journal.complete(task)
+        journal.complete(object())
+        self.assertEqual(len(journal.pending()), 2)
+        self.assertEqual(len(journal._entries), 2)
+        journal.complete(task)
+        journal.complete(task)
+        journal.close()
+
+        journal = self.open()
+        self.assertEqual(len(journal.pending()), 1)
+        journal.close()
+
+    def test_stale_tasks_are_dropped(self):
+        journal = self.open()
+        journal.append(ToggleStatusTask(target="33", toggled=True))
+        self.clock.now += 10
+        journal.append(ToggleStatusTask(target="34", toggled=True))
+        journal.close()
+
+        self.clock.now += 5
+        journal = self.open(max_age=10)
+        targets = [task.target for task in journal.pending()]
+        journal.close()
+        self.assertEqual(targets, ["34"])
+
+    def test_torn_record_is_skipped(self):
+        journal = self.open()
+        journal.append(GetStatusTask(target="33"))
+        journal.close()
+        with open(self.path, "a") as handle:
+            handle.write('{"op":"add","id":1,"ti')
+
+        journal = self.open()
+        targets = [task.target for task in journal.pending()]
+        journal.append(GetStatusTask(target="34"))
+        journal.close()
+        self.assertEqual(targets, ["33"])
+
+    def test_compaction(self):
+        journal = self.open(compact_threshold=10)
+        tasks = [GetStatusTask(target="{:02}".format(index))
+                 for index in range(20)]
+        for task in tasks:
+            journal.append(task)
+        journal.sync()
+        for task in tasks:
+            journal.complete(task)
+        journal.append(GetStatusTask(target="99"))
+        journal.close()
+
+        # 41 records have been written
+        with open(self.path) as handle:
+            self.assertLess(len(handle.readlines()), 30)
+        journal = self.open()
+        targets = [task.target for task in journal.pending()]
+        journal.close()
+        self.assertEqual(targets, ["99"])
+
+    def test_reactor_replays_the_journal(self):
+        journal = self.open()
+        journal.append(ToggleStatusTask(target="33", toggled=True))
+        journal.close()
+
+        journal = self.open()
+        sim = Simulation()
+        reactor = sim.reactor(journal=journal)
+        sim.at(0.1, lambda: reactor.append_task(
+            ToggleStatusTask(target="34", toggled=True)))
+        sim.run(reactor, until=0.1)
+        pending = journal.pending()
+        journal.close()
+
+        written = [data for _, data in sim.serial.log]
+        self.assertIn(b"@w033", written)
+        # queued while stopping: kept for the next run
+        self.assertEqual([task.target for task in pending], ["34"])
@@ -0,0 +1,70 @@
+# Test the structured logging helpers
+
+import io
+import json
+import logging
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate import log  # NOQA E402
+
+
+class Exploding:
+    """ Fails the test if it's ever formatted """
+
+    def __str__(self):
+        raise AssertionError("formatted while the level is disabled")
+
+
+class TestLog(unittest.TestCase):
+    """ Test the logging helpers """
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = logging.StreamHandler(self.stream)
+        self.logger = logging.getLogger("scsgate.test.log")
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_lazy_when_disabled(self):
+        self.logger.setLevel(logging.INFO)
+        self.logger.debug("%s", log.LazyJoin([Exploding()]))
+        log.log_event(self.logger, logging.DEBUG, "message", x=Exploding())
+        self.assertEqual(self.stream.getvalue(), "")
+
+    def test_json_lines(self):
+        self.logger.setLevel(logging.DEBUG)
+        self.handler.setFormatter(log.JsonLinesFormatter())
+        log.log_event(self.logger, logging.DEBUG, "message",
+                      entity="33", raw="A8B833120198A3")
+        document = json.loads(self.stream.getvalue())
+        self.assertEqual(document["event"], "message")
+        self.assertEqual(document["entity"], "33")
+        self.assertEqual(document["level"], "DEBUG")
+
+    def test_structured_text(self):
+        self.logger.setLevel(logging.DEBUG)
+        self.handler.setFormatter(log.StructuredFormatter("%(message)s"))
+        log.log_event(self.logger, logging.INFO, "reconnected", attempt=2)
+        self.logger.info("%s", log.LazyJoin(["A8", "B8"]))
+        self.assertEqual(
+            self.stream.getvalue(), "reconnected attempt=2\nA8 B8\n")
+
+    def test_async(self):
+        logger = logging.getLogger("scsgate.test.async")
+        logger.propagate = False
+        listener = log.setup_async_logging(
+            formatter=log.StructuredFormatter("%(message)s"),
+            logger=logger)
+        listener.handlers[0].setStream(self.stream)
+        log.log_event(logger, logging.DEBUG, "message", entity="33")
+        listener.stop()
+        self.assertEqual(self.stream.getvalue(), "message entity=33\n")
@@ -118,3 +118,81 @@ class TestMessages(unittest.TestCase):
                     expected,
                     actual)
             )
+
+    def test_strict_parse_valid_telegram(self):
+        messages.validation_stats.reset()
+        msg = messages.parse(b"A8B833120198A3", strict=True)
+        self.assertIsInstance(msg, messages.StateMessage)
+        self.assertEqual(messages.validation_stats.accepted, 1)
+
+    def test_strict_parse_rejects_invalid_telegrams(self):
+        messages.validation_stats.reset()
+        test_data = {
+            b"A8B833120199A3": "bad_checksum",
+            b"A9B833120198A3": "bad_start",
+            b"A8B833120198A4": "bad_end",
+            b"A8B83312019": "malformed",
+            b"A8B8ZZ120198A3": "malformed",
+        }
+
+        for data, reason in test_data.items():
+            msg = messages.parse(data, strict=True)
+            self.assertIsInstance(msg, messages.InvalidMessage)
+            self.assertEqual(msg.reason, reason)
+
+        self.assertEqual(messages.validation_stats.accepted, 0)
+        self.assertEqual(
+            messages.validation_stats.rejected,
+            {"malformed": 2, "bad_start": 1, "bad_end": 1,
+             "bad_checksum": 1})
+
+    def test_parse_ack_skips_validation(self):
+        messages.validation_stats.reset()
+        msg = messages.parse(b"A5", strict=True)
+        self.assertIsInstance(msg, messages.AckMessage)
+        self.assertEqual(messages.validation_stats.accepted, 0)
+
+    def test_as_dict(self):
+        msg = messages.parse(b"A8B833120198A3")
+        self.assertEqual(
+            msg.as_dict(),
+            {"type": "StateMessage", "entity": "33", "source": "33",
+             "status": "off", "raw": "A8B833120198A3"})
+
+        msg = messages.parse(b"A83300120021A3")
+        self.assertEqual(
+            msg.as_dict(),
+            {"type": "CommandMessage", "entity": "33", "destination": "33",
+             "source": "00", "status": "on", "raw": "A83300120021A3"})
+
+    def test_register_decoder(self):
+        class DimmerMessage(messages.SCSMessage):
+            @property
+            def entity(self):
+                return self._data[1]
+
+        messages.register_decoder(DimmerMessage, command="1d")
+        try:
+            msg = messages.parse(b"A833001D002EA3")
+            self.assertIsInstance(msg, DimmerMessage)
+            self.assertEqual(msg.entity, "33")
+            # builtin decoders are not affected
+            msg = messages.parse(b"A83300120021A3")
+            self.assertIsInstance(msg, messages.CommandMessage)
+        finally:
+            messages.unregister_decoder(command="1D")
+
+        msg = messages.parse(b"A833001D002EA3")
+        self.assertIsInstance(msg, messages.UnknownMessage)
+
+    def test_register_decoder_by_address_and_length(self):
+        messages.register_decoder(
+            messages.RequestStatusMessage, address="33", length=8)
+        try:
+            msg = messages.parse(b"A8330015000026A3")
+            self.assertIsInstance(msg, messages.RequestStatusMessage)
+        finally:
+            messages.unregister_decoder(address="33", length=8)
+
+        with self.assertRaises(ValueError):
+            messages.register_decoder(messages.SCSMessage)
@@ -0,0 +1,140 @@
+# Test the MQTT bridge
+
+import time
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate import messages  # NOQA E402
+from scsgate.mqtt import Bridge  # NOQA E402
+from scsgate.tasks import LowerRollerShutterTask  # NOQA E402
+
+
+class FakeBroker:
+    """ Stand-in for a MQTT client connected to a broker """
+
+    def __init__(self):
+        self.published = []
+        self.subscriptions = []
+        self.on_connect = None
+        self.on_message = None
+
+    def connect(self):
+        self.on_connect(self, None, {}, 0)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.published.append((topic, payload, retain))
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.append(topic)
+
+    def deliver(self, topic, payload):
+        message = FakeMQTTMessage(topic, payload)
+        self.on_message(self, None, message)
+
+
+class FakeMQTTMessage:
+    """ A message received from the broker """
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeReactor:
+    """ Collects the tasks """
+
+    def __init__(self):
+        self.tasks = []
+
+    def append_task(self, task):
+        self.tasks.append(task)
+
+
+class TestBridge(unittest.TestCase):
+    """ Test the MQTT bridge """
+
+    def setUp(self):
+        self.broker = FakeBroker()
+        self.reactor = FakeReactor()
+        self.bridge = Bridge(self.broker, queue_size=2)
+        self.bridge.start(self.reactor)
+        self.broker.connect()
+
+    def tearDown(self):
+        self.bridge.stop()
+
+    def test_states_are_coalesced_and_retained(self):
+        with self.bridge._condition:
+            self.bridge.handle_message(messages.parse(b"A8B833120098A3"))
+            self.bridge.handle_message(messages.parse(b"A8B834120098A3"))
+            self.bridge.handle_message(messages.parse(b"A8B833120198A3"))
+            self.bridge.flush()
+
+        self.assertEqual(
+            self.broker.published,
+            [("scsgate/34/state", "on", True),
+             ("scsgate/33/state", "off", True)])
+
+    def test_events_are_bounded(self):
+        with self.bridge._condition:
+            for _ in range(3):
+                self.bridge.handle_message(
+                    messages.parse(b"A83300120021A3"))
+            self.bridge.flush()
+
+        self.assertEqual(self.bridge.dropped, 1)
+        self.assertEqual(len(self.broker.published), 2)
+        self.assertEqual(self.broker.published[0][0], "scsgate/33/command")
+        self.assertFalse(self.broker.published[0][2])
+
+    def test_commands(self):
+        self.assertEqual(self.broker.subscriptions, ["scsgate/+/set"])
+        self.broker.deliver("scsgate/40/set", b"lower")
+        self.broker.deliver("scsgate/40/set", b"dance")
+        # the device ID is written to SCSGate: it must not carry commands
+        self.broker.deliver("scsgate/40@b/set", b"lower")
+
+        self.assertEqual(len(self.reactor.tasks), 1)
+        self.assertIsInstance(self.reactor.tasks[0], LowerRollerShutterTask)
+
+    def test_subscribe_on_every_connection(self):
+        broker = FakeBroker()
+        bridge = Bridge(broker)
+        bridge.start(self.reactor)
+        self.assertEqual(broker.subscriptions, [])
+        broker.connect()
+        # reconnection with a clean session
+        broker.connect()
+        bridge.stop()
+        self.assertEqual(broker.subscriptions, ["scsgate/+/set"] * 2)
+
+    def test_stop_publishes_all_the_pending_messages(self):
+        broker = FakeBroker()
+        bridge = Bridge(broker, batch_size=2)
+        for entity in range(5):
+            bridge.handle_message(messages.parse(
+                messages.compose_telegram(
+                    [b"B8", "3{}".format(entity).encode(), b"12", b"00"])))
+        bridge.stop()
+        self.assertEqual(len(broker.published), 5)
+
+    def test_messages_wait_for_the_flush_interval(self):
+        broker = FakeBroker()
+        bridge = Bridge(broker, flush_interval=0.3)
+        bridge.start(self.reactor)
+        try:
+            bridge.handle_message(messages.parse(b"A8B833120098A3"))
+            time.sleep(0.05)
+            bridge.handle_message(messages.parse(b"A8B834120098A3"))
+            time.sleep(0.05)
+            # the second message does not cut the interval short
+            self.assertEqual(broker.published, [])
+            time.sleep(0.5)
+            self.assertEqual(len(broker.published), 2)
+        finally:
+            bridge.stop()
@@ -0,0 +1,46 @@
+# Test the command pacer
+
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate.pacing import CommandPacer  # NOQA E402
+
+
+class TestCommandPacer(unittest.TestCase):
+    """ Test CommandPacer """
+
+    def test_burst_then_refill(self):
+        pacer = CommandPacer(rate=10.0, burst=2)
+        now = 100.0
+        self.assertTrue(pacer.try_acquire(now))
+        self.assertTrue(pacer.try_acquire(now))
+        self.assertFalse(pacer.try_acquire(now))
+        self.assertTrue(pacer.try_acquire(now + 0.2))
+
+    def test_rate_adapts_to_acks(self):
+        pacer = CommandPacer(rate=10.0, min_rate=2.0, max_rate=12.0,
+                             increase_step=1.0, target_latency=0.05)
+        pacer.record_success(0.01)
+        self.assertEqual(pacer.rate, 11.0)
+        pacer.record_success(0.01)
+        pacer.record_success(0.01)
+        self.assertEqual(pacer.rate, 12.0)
+        pacer.record_success(0.2)
+        self.assertEqual(pacer.rate, 6.0)
+        pacer.record_failure()
+        pacer.record_failure()
+        self.assertEqual(pacer.rate, 2.0)
+
+    def test_cost_larger_than_burst(self):
+        # fixed clock: the debt is paid back exactly at now + 0.5
+        pacer = CommandPacer(rate=10.0, burst=2, clock=lambda: 0.0)
+        now = 0.0
+        # a scene of 6 commands borrows the 4 tokens it lacks
+        self.assertTrue(pacer.try_acquire(now, cost=6))
+        self.assertFalse(pacer.try_acquire(now + 0.3))
+        self.assertTrue(pacer.try_acquire(now + 0.5))
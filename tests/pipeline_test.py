@@ -0,0 +1,60 @@
+# Test the parsing of captures
+
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate import messages, pipeline  # NOQA E402
+
+
+CAPTURE = (b"7A8B833120098A3" b"0" b"7A83300120021A3" b"7A8B833120198A3"
+           b"1A5" b"7A8B83412")
+
+
+class TestPipeline(unittest.TestCase):
+    """ Test the parsing of captures """
+
+    def test_frame_bounds(self):
+        self.assertEqual(
+            pipeline.frame_bounds(CAPTURE),
+            [(1, 15), (17, 31), (32, 46), (47, 49)])
+
+    def test_shard_ranges(self):
+        self.assertEqual(
+            pipeline.shard_ranges(CAPTURE, 2),
+            [(0, 16), (16, 46), (46, 58)])
+        self.assertEqual(pipeline.shard_ranges(CAPTURE, 100), [(0, 58)])
+        self.assertEqual(pipeline.shard_ranges(b"", 2), [])
+
+    def test_analyse_in_process(self):
+        stats = pipeline.analyse([CAPTURE], processes=1)[0]
+        self.assertEqual(
+            stats,
+            {"33": {"count": 3,
+                    "types": {"StateMessage": 2, "CommandMessage": 1},
+                    "status": "off"}})
+
+    def test_analyse_with_pool(self):
+        other = b"7A8B834120098A3"
+        expected = pipeline.analyse([CAPTURE, other], processes=1)
+        actual = pipeline.analyse(
+            [CAPTURE, other], processes=2, shard_size=1)
+        self.assertEqual(actual, expected)
+
+    def test_strict_counters_of_the_workers(self):
+        captures = [CAPTURE, b"7A8B833120099A3"]
+        messages.validation_stats.reset()
+        expected = pipeline.analyse(captures, processes=1, strict=True)
+        counters = messages.validation_stats.as_dict()
+        self.assertEqual(counters["rejected_bad_checksum"], 1)
+
+        messages.validation_stats.reset()
+        actual = pipeline.analyse(
+            captures, processes=2, shard_size=2, strict=True)
+        self.assertEqual(actual, expected)
+        self.assertEqual(messages.validation_stats.as_dict(), counters)
+        messages.validation_stats.reset()
@@ -0,0 +1,250 @@
+# Test the Reactor
+
+import logging
+import threading
+import time
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate.reactor import Reactor  # NOQA E402
+from scsgate.reader import BufferedReader  # NOQA E402
+from scsgate.tasks import GetStatusTask, ToggleStatusTask  # NOQA E402
+
+
+class FakeSerial:
+    """ Serial port replaying a list of responses """
+
+    def __init__(self, responses, fail_when_empty=True):
+        self.responses = list(responses)
+        self.written = []
+        self.fail_when_empty = fail_when_empty
+        self.read_hook = None
+
+    def write(self, data):
+        self.written.append(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.responses[0]) if self.responses else 0
+
+    def read(self, size=1):
+        if self.read_hook:
+            self.read_hook(self)
+        if not self.responses:
+            if self.fail_when_empty:
+                raise OSError("device disconnected")
+            return b"0"
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+
+class FakeBus:
+    """ Serial port emulating a SCSGate attached to devices answering
+    to status requests """
+
+    def __init__(self, silent=()):
+        self.silent = silent
+        self.written = []
+        self._output = []
+        self._messages = []
+
+    def write(self, data):
+        self.written.append(data)
+        if data == b"@r":
+            if self._messages:
+                message = self._messages.pop(0)
+                self._output += [b"7", message]
+            else:
+                self._output.append(b"0")
+            return
+
+        self._output.append(b"k")
+        if data.startswith(b"@W7"):
+            target = data[5:7]
+            if target.decode() not in self.silent:
+                self._messages.append(b"A8B8" + target + b"120098A3")
+
+    @property
+    def in_waiting(self):
+        return len(self._output[0]) if self._output else 0
+
+    def read(self, size=1):
+        return self._output.pop(0)
+
+    def close(self):
+        pass
+
+
+class BlockingSerial:
+    """ Serial port whose reads block until cancel_read is invoked, like
+    the ones of a gateway which stopped answering """
+
+    def __init__(self):
+        self.written = []
+        self._cancelled = threading.Event()
+
+    def write(self, data):
+        self.written.append(data)
+
+    @property
+    def in_waiting(self):
+        return 0
+
+    def read(self, size=1):
+        self._cancelled.wait(10)
+        self._cancelled.clear()
+        return b""
+
+    def cancel_read(self):
+        self._cancelled.set()
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """ Connection wrapping a FakeSerial """
+
+    def __init__(self, serial):
+        self.serial = serial
+        self.reader = BufferedReader(serial)
+
+    def close(self):
+        pass
+
+
+class TestReactor(unittest.TestCase):
+    """ Test the Reactor """
+
+    def test_reconnect_and_resync(self):
+        messages = []
+        second = FakeConnection(FakeSerial([], fail_when_empty=False))
+
+        def handle_message(message):
+            messages.append(message)
+            if len(messages) > 1:
+                reactor.stop()
+
+        def reconnect():
+            return second
+
+        # the first connection reports the state of entity 33, then dies
+        first = FakeConnection(FakeSerial([b"7", b"A8B833120098A3"]))
+        second.serial.responses = [b"k", b"7", b"A8B833120198A3"]
+
+        reactor = Reactor(
+            connection=first,
+            handle_message=handle_message,
+            logger=logging.getLogger("test"),
+            connection_factory=reconnect,
+            backoff_initial=0)
+        reactor.run()
+
+        self.assertEqual(reactor.known_entities, frozenset(["33"]))
+        # the first command on the new connection is the status request
+        self.assertEqual(second.serial.written[0], b"@W7A83300150026A3")
+        self.assertEqual(messages[-1].status, "off")
+
+    def test_io_error_without_factory_is_fatal(self):
+        reactor = Reactor(
+            connection=FakeConnection(FakeSerial([])),
+            handle_message=lambda message: None,
+            logger=logging.getLogger("test"))
+        reactor.append_task(GetStatusTask(target="33"))
+        with self.assertRaises(OSError):
+            reactor.run()
+
+    def test_failed_command_is_retried(self):
+        serial = FakeSerial([b"E", b"k"], fail_when_empty=False)
+        reactor = Reactor(
+            connection=FakeConnection(serial),
+            handle_message=lambda message: None,
+            logger=logging.getLogger("test"),
+            max_retries=1,
+            retry_delay=0)
+        reactor.append_task(ToggleStatusTask(target="33", toggled=True))
+
+        def stop_when_done(connection):
+            if len(serial.written) > 2:
+                reactor.stop()
+        serial.read_hook = stop_when_done
+        reactor.run()
+
+        self.assertEqual(serial.written[:2], [b"@w033", b"@w033"])
+
+    def test_refresh_all(self):
+        bus = FakeBus(silent=["35"])
+        reactor = Reactor(
+            connection=FakeConnection(bus),
+            handle_message=lambda message: None,
+            logger=logging.getLogger("test"))
+        thread = threading.Thread(target=reactor.run)
+        thread.start()
+        try:
+            results = reactor.refresh_all(
+                ["33", "34", "35", "33"], window=2, timeout=0.2)
+        finally:
+            reactor.stop()
+            thread.join()
+
+        self.assertEqual(sorted(results), ["33", "34", "35"])
+        self.assertEqual(results["33"].entity, "33")
+        self.assertEqual(results["34"].status, "on")
+        self.assertIsNone(results["35"])
+
+    def test_refresh_all_without_reactor_thread(self):
+        reactor = Reactor(
+            connection=FakeConnection(FakeBus()),
+            handle_message=lambda message: None,
+            logger=logging.getLogger("test"))
+        started = time.monotonic()
+        results = reactor.refresh_all(["33", "34"], timeout=0.1)
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual(results, {"33": None, "34": None})
+
+    def test_refresh_all_wait_is_bounded(self):
+        # the reactor thread is stuck on a read
+        reactor = Reactor(
+            connection=FakeConnection(BlockingSerial()),
+            handle_message=lambda message: None,
+            logger=logging.getLogger("test"))
+        reactor.start()
+        try:
+            started = time.monotonic()
+            results = reactor.refresh_all(["33"], window=1, timeout=0.1)
+            elapsed = time.monotonic() - started
+        finally:
+            reactor.stop(timeout=2.0)
+            reactor.join()
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(results, {"33": None})
+
+    def test_refresh_all_window_must_be_positive(self):
+        reactor = Reactor(
+            connection=FakeConnection(FakeBus()),
+            handle_message=lambda message: None,
+            logger=logging.getLogger("test"))
+        with self.assertRaises(ValueError):
+            reactor.refresh_all(["33"], window=0)
+
+    def test_stop_wakes_up_blocked_read(self):
+        reactor = Reactor(
+            connection=FakeConnection(BlockingSerial()),
+            handle_message=lambda message: None,
+            logger=logging.getLogger("test"))
+        reactor.start()
+        reactor.append_task(ToggleStatusTask(target="33", toggled=True))
+
+        report = reactor.stop(timeout=2.0)
+        self.assertTrue(report.finished)
+        self.assertLess(report.elapsed, 2.0)
+        self.assertEqual(len(report.dropped), 1)
+        reactor.join()
@@ -0,0 +1,60 @@
+# Test the buffered reader
+
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate.reader import (  # NOQA E402
+    BufferedReader, FramingError, ReadTimeout)
+
+
+class FakeSerial:
+    """ Serial port with some bytes waiting to be read """
+
+    def __init__(self, data=b""):
+        self.data = data
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def read(self, size=1):
+        chunk = self.data[:size]
+        self.data = self.data[size:]
+        return chunk
+
+
+class TestBufferedReader(unittest.TestCase):
+    """ Test BufferedReader """
+
+    def test_many_frames_with_one_read(self):
+        serial = FakeSerial(b"k7A8B833120198A30" b"7A83300120021A3")
+        reader = BufferedReader(serial)
+
+        self.assertEqual(reader.read(1), b"k")
+        self.assertEqual(reader.read_frame(), b"A8B833120198A3")
+        self.assertEqual(reader.read_frame(), b"")
+        self.assertEqual(reader.read_frame(), b"A83300120021A3")
+        self.assertEqual(reader.reads, 1)
+        self.assertEqual(reader.buffered, 0)
+
+    def test_deadline(self):
+        serial = FakeSerial(b"7A8B8")
+        reader = BufferedReader(serial, timeout=0.01)
+
+        with self.assertRaises(ReadTimeout):
+            reader.read_frame()
+        # the partial answer must not be taken for the next one
+        self.assertEqual(reader.buffered, 0)
+
+    def test_invalid_frame_length(self):
+        serial = FakeSerial(b"k0")
+        reader = BufferedReader(serial)
+
+        with self.assertRaises(FramingError):
+            reader.read_frame()
+        self.assertEqual(reader.buffered, 0)
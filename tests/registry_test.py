@@ -0,0 +1,99 @@
+# Test the device registry
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate.registry import DeviceRegistry  # NOQA E402
+
+
+CONFIG = """
+devices:
+  living_room:
+    name: Living room
+    scs_id: "33"
+  kitchen:
+    name: Kitchen
+    scs_id: "34"
+"""
+
+
+class TestDeviceRegistry(unittest.TestCase):
+    """ Test DeviceRegistry """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "devices.yaml")
+        with open(self.path, "w") as config:
+            config.write(CONFIG)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_add(self):
+        registry = DeviceRegistry()
+        self.assertEqual(registry.add("33"), 0)
+        self.assertEqual(registry.add("34", ha_id="kitchen"), 1)
+        self.assertEqual(registry.add("33", name="Living room"), 0)
+
+        self.assertIn("33", registry)
+        self.assertNotIn("35", registry)
+        self.assertIsNone(registry.index("35"))
+        self.assertEqual(
+            list(registry.devices()),
+            [("33", None, "Living room"), ("34", "kitchen", None)])
+
+    def test_load_without_snapshot(self):
+        registry = DeviceRegistry()
+        registry.load(self.path)
+        self.assertEqual(os.listdir(self.directory), ["devices.yaml"])
+        self.assertEqual(registry.entities, ["33", "34"])
+
+    def test_load_and_snapshot(self):
+        cache = os.path.join(self.directory, "devices.cache")
+        registry = DeviceRegistry()
+        registry.load(self.path, cache=cache)
+        self.assertTrue(os.path.isfile(cache))
+
+        cached = DeviceRegistry()
+        cached.load(self.path, cache=cache)
+
+        expected = [("33", "living_room", "Living room"),
+                    ("34", "kitchen", "Kitchen")]
+        self.assertEqual(sorted(registry.devices()), sorted(expected))
+        self.assertEqual(sorted(cached.devices()), sorted(expected))
+
+    def test_snapshot_of_changed_document_is_ignored(self):
+        cache = os.path.join(self.directory, "devices.cache")
+        DeviceRegistry().load(self.path, cache=cache)
+        with open(self.path, "a") as config:
+            config.write("""  hall:\n    name: Hall\n    scs_id: "35"\n""")
+
+        registry = DeviceRegistry()
+        registry.load(self.path, cache=cache)
+        self.assertEqual(registry.entities, ["33", "34", "35"])
+
+    def test_corrupted_snapshot_is_ignored(self):
+        cache = os.path.join(self.directory, "devices.cache")
+        with open(cache, "wb") as snapshot:
+            snapshot.write(b"garbage")
+        registry = DeviceRegistry()
+        registry.load(self.path, cache=cache)
+        self.assertEqual(registry.entities, ["33", "34"])
+
+    def test_tagged_values_are_not_cached(self):
+        with open(self.path, "a") as config:
+            config.write("""  hall:\n    name: !secret hall\n"""
+                         """    scs_id: "35"\n""")
+        cache = os.path.join(self.directory, "devices.cache")
+        registry = DeviceRegistry()
+        registry.load(self.path, cache=cache)
+        self.assertEqual(registry.entities, ["33", "34", "35"])
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["devices.yaml"])
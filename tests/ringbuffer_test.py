@@ -0,0 +1,48 @@
+# Test the ring buffer
+
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate.ringbuffer import MessageRing  # NOQA E402
+
+
+class TestMessageRing(unittest.TestCase):
+    """ Test MessageRing """
+
+    def test_read_in_order(self):
+        ring = MessageRing(capacity=4, slot_size=16)
+        cursor = ring.cursor()
+        ring.append(b"A8B833120198A3")
+        ring.append(b"A5")
+
+        self.assertEqual(cursor.pending, 2)
+        self.assertEqual(list(cursor), [b"A8B833120198A3", b"A5"])
+        self.assertIsNone(cursor.read())
+        self.assertEqual(cursor.overruns, 0)
+
+    def test_overrun(self):
+        ring = MessageRing(capacity=3, slot_size=4)
+        cursor = ring.cursor()
+        for i in range(5):
+            ring.append(str(i).encode())
+
+        self.assertEqual(list(cursor), [b"2", b"3", b"4"])
+        self.assertEqual(cursor.overruns, 2)
+
+    def test_independent_cursors_and_truncation(self):
+        ring = MessageRing(capacity=2, slot_size=4)
+        ring.append(b"A8B833")
+        first = ring.cursor(from_start=True)
+        second = ring.cursor()
+        ring.append(b"A5")
+
+        buffer = bytearray(4)
+        self.assertEqual(first.read_into(buffer), 4)
+        self.assertEqual(buffer, b"A8B8")
+        self.assertEqual(first.read(), b"A5")
+        self.assertEqual(second.read(), b"A5")
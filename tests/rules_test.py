@@ -0,0 +1,98 @@
+# Test the rules engine
+
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate import messages  # NOQA E402
+from scsgate.rules import RulesEngine  # NOQA E402
+
+
+RULES = """
+rules:
+  - name: good night
+    when:
+      type: scenario
+      entity: "31"
+      scenario: "01"
+    then:
+      - "off": "33"
+      - lower: "40"
+  - when:
+      type: state
+      entity: "33"
+      status: on
+    then:
+      - on: "3a"
+"""
+
+
+class FakeReactor:
+    """ Collects the tasks """
+
+    def __init__(self):
+        self.tasks = []
+        self.listeners = []
+
+    def append_task(self, task):
+        self.tasks.append(task)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+
+class TestRulesEngine(unittest.TestCase):
+    """ Test RulesEngine """
+
+    def setUp(self):
+        self.reactor = FakeReactor()
+        self.engine = RulesEngine.from_yaml(RULES)
+        self.engine.start(self.reactor)
+
+    def test_scenario_rule(self):
+        self.engine.handle_message(
+            messages.ScenarioTriggeredMessage(
+                ["A8", "31", "00", "14", "01", "24", "A3"]))
+        self.assertEqual(len(self.reactor.tasks), 1)
+        scene = self.reactor.tasks[0].scene
+        self.assertEqual(scene.name, "good night")
+        self.assertEqual(scene.payload, b"@w133@w940")
+
+    def test_conditions(self):
+        self.engine.handle_message(messages.parse(b"A8B833120198A3"))
+        self.engine.handle_message(
+            messages.ScenarioTriggeredMessage(
+                ["A8", "31", "00", "14", "02", "27", "A3"]))
+        self.assertEqual(self.reactor.tasks, [])
+
+        self.engine.handle_message(messages.parse(b"A8B833120099A3"))
+        self.assertEqual(len(self.reactor.tasks), 1)
+        self.assertEqual(self.reactor.tasks[0].scene.payload, b"@w03A")
+
+    def test_invalid_rules(self):
+        invalid = [
+            {"when": {"type": "state"}, "then": []},
+            {"when": {"type": "light", "entity": "33"}, "then": []},
+            {"when": {"type": "state", "entity": "33", "scenario": "1"},
+             "then": []},
+            {"when": {"type": "state", "entity": "33"},
+             "then": [{"dance": "33"}]},
+            # unquoted IDs, read by YAML as numbers
+            {"when": {"type": "state", "entity": 8}, "then": []},
+            {"when": {"type": "state", "entity": "33"},
+             "then": [{"off": 40}]},
+            {"when": {"type": "scenario", "entity": "31", "scenario": 1},
+             "then": []},
+            {"when": {"type": "state", "entity": "33", "status": "dim"},
+             "then": []},
+            {"when": {"type": "state", "entity": "33@b"}, "then": []},
+            {"when": {"type": "state", "entity": "33"},
+             "then": [{"on": "34@b"}]},
+        ]
+        for rule in invalid:
+            with self.assertRaises(ValueError):
+                RulesEngine([rule])
@@ -0,0 +1,70 @@
+# Test scenes
+
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate import scenes  # NOQA E402
+from scsgate.reader import ReadTimeout  # NOQA E402
+from scsgate.simulation import Simulation  # NOQA E402
+from scsgate.tasks import (  # NOQA E402
+    ExecutionError, LowerRollerShutterTask, ToggleStatusTask)
+
+
+class TestScenes(unittest.TestCase):
+    """ Test scenes """
+
+    def setUp(self):
+        self.registry = scenes.SceneRegistry()
+        self.members = [
+            ToggleStatusTask(target="33", toggled=False),
+            ToggleStatusTask(target="34", toggled=True),
+            LowerRollerShutterTask(target="40")]
+        self.scene = self.registry.register("night", self.members)
+
+    def test_compile(self):
+        self.assertEqual(
+            self.scene.frames, (b"@w133", b"@w034", b"@w940"))
+        self.assertEqual(self.scene.payload, b"@w133@w034@w940")
+        self.assertIn("night", self.registry)
+
+    def test_activation_single_write(self):
+        sim = Simulation()
+        task = scenes.SceneTask(self.scene)
+        task.execute(sim.connection)
+
+        self.assertEqual([data for _, data in sim.serial.log],
+                         [b"@w133@w034@w940"])
+        self.assertTrue(task.wait(0).success)
+        self.assertEqual(task.result.acked, tuple(self.members))
+
+    def test_activation_reports_failures(self):
+        sim = Simulation()
+        sim.serial.refuse(b"@w034")
+        task = scenes.SceneTask(self.scene)
+        with self.assertRaises(ExecutionError):
+            task.execute(sim.connection)
+
+        self.assertFalse(task.result.success)
+        self.assertEqual(task.result.failed, (self.members[1],))
+
+    def test_activation_timeout(self):
+        sim = Simulation(read_timeout=0.2)
+        # the gateway hangs right after the first ack
+        sim.serial.refuse(b"@w034", answer=b"")
+        sim.serial.refuse(b"@w940", answer=b"")
+        task = scenes.SceneTask(self.scene)
+        with self.assertRaises(ReadTimeout):
+            task.execute(sim.connection)
+
+        # the waiters are woken up, the members without ack failed
+        result = task.wait()
+        self.assertEqual(result.acked, (self.members[0],))
+        self.assertEqual(result.failed, tuple(self.members[1:]))
+
+    def test_cost(self):
+        self.assertEqual(scenes.SceneTask(self.scene).cost, 3)
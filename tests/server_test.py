@@ -0,0 +1,189 @@
+# Test scs-server
+
+import argparse
+import asyncio
+import json
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate import messages  # NOQA E402
+from scsgate.server import Client, Server, task_from_request  # NOQA E402
+from scsgate.tasks import (  # NOQA E402
+    GetStatusTask, RaiseRollerShutterTask, ToggleStatusTask)
+
+
+STATE_ON = messages.parse(b"A8B833120099A3")
+STATE_OFF_34 = messages.parse(b"A8B83412019FA3")
+
+
+class FakeReactor:
+    """ Collects the queued tasks """
+
+    def __init__(self):
+        self.tasks = []
+
+    def append_task(self, task):
+        self.tasks.append(task)
+
+
+class FakeWriter:
+    """ Stand-in for asyncio.StreamWriter """
+
+    def __init__(self, error=None):
+        self.written = []
+        self.error = error
+
+    def write(self, data):
+        self.written.append(data)
+
+    async def drain(self):
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        pass
+
+
+class FakeReader:
+    """ Stand-in for asyncio.StreamReader replaying some lines """
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+
+    async def readline(self):
+        # let the other tasks run, like a socket read would
+        await asyncio.sleep(0)
+        return self.lines.pop(0) if self.lines else b""
+
+
+def received(client):
+    """ Returns the decoded lines queued for a client """
+    lines = []
+    while not client._queue.empty():
+        line, _ = client._queue.get_nowait()
+        lines.append(json.loads(line.decode()))
+    return lines
+
+
+class TestServer(unittest.TestCase):
+    """ Test the Server class """
+
+    def setUp(self):
+        options = argparse.Namespace(verbose=False, queue_size=2)
+        self.server = Server(options)
+        self.server._reactor = FakeReactor()
+        self.client = self.add_client()
+
+    def add_client(self):
+        client = Client(FakeWriter(), queue_size=2)
+        self.server._clients.add(client)
+        return client
+
+    def request(self, client, **request):
+        line = json.dumps(request).encode()
+        return self.server._handle_request(client, line)
+
+    def test_commands(self):
+        self.assertEqual(
+            self.request(self.client, command="toggle", target="33",
+                         toggled=True),
+            {"type": "ok"})
+        self.request(self.client, command="raise", target="4A")
+        self.request(self.client, command="status", target="33")
+        self.assertEqual(
+            self.server._reactor.tasks,
+            [ToggleStatusTask(target="33", toggled=True),
+             RaiseRollerShutterTask(target="4A"),
+             GetStatusTask(target="33")])
+
+    def test_invalid_requests(self):
+        for request in (b"not json",
+                        b'{"target": "33"}',
+                        b'{"command": "dance", "target": "33"}',
+                        b'{"command": "toggle", "target": "33"}',
+                        b'{"command": "halt", "target": "33@b"}',
+                        b'{"command": "halt", "target": 33}'):
+            reply = self.server._handle_request(self.client, request)
+            self.assertEqual(reply["type"], "error", request)
+        self.assertEqual(self.server._reactor.tasks, [])
+
+    def test_subscriptions(self):
+        everything = self.add_client()
+        idle = self.add_client()
+        self.request(self.client, command="subscribe", entities=["34"])
+        self.request(everything, command="subscribe")
+
+        self.server._broadcast(STATE_ON)
+        self.server._broadcast(STATE_OFF_34)
+
+        self.assertEqual(
+            [line["message"]["entity"] for line in received(self.client)],
+            ["34"])
+        self.assertEqual(
+            [line["message"]["entity"] for line in received(everything)],
+            ["33", "34"])
+        self.assertEqual(received(idle), [])
+
+        self.request(self.client, command="unsubscribe")
+        self.server._broadcast(STATE_OFF_34)
+        self.assertEqual(received(self.client), [])
+
+    def test_slow_client_drops_events(self):
+        self.request(self.client, command="subscribe")
+        for _ in range(5):
+            self.server._broadcast(STATE_ON)
+        self.assertEqual(len(received(self.client)), 2)
+        self.assertEqual(self.client.dropped, 3)
+
+    def test_replies_are_not_dropped(self):
+        self.request(self.client, command="subscribe")
+        for _ in range(3):
+            self.server._broadcast(STATE_ON)
+        for _ in range(3):
+            self.client.reply(b'{"type": "ok"}\n')
+        lines = received(self.client)
+        self.assertEqual([line["type"] for line in lines],
+                         ["message", "message", "ok", "ok", "ok"])
+        self.assertEqual(self.client.dropped, 1)
+
+    def test_subscribe_validates_entities(self):
+        self.assertEqual(
+            self.request(self.client, command="subscribe",
+                         entities=["3a"]),
+            {"type": "ok"})
+        self.server._broadcast(messages.parse(b"A8B83A120090A3"))
+        self.assertEqual(
+            [line["message"]["entity"] for line in received(self.client)],
+            ["3A"])
+
+        for entities in ("33", ["33@b"], [33]):
+            reply = self.request(
+                self.client, command="subscribe", entities=entities)
+            self.assertEqual(reply["type"], "error", entities)
+
+    def test_failed_flush_is_retrieved(self):
+        writer = FakeWriter(error=ConnectionResetError("reset by peer"))
+        reader = FakeReader([b'{"command": "snapshot"}\n'] * 2)
+        with self.assertLogs(level="INFO") as logs:
+            asyncio.run(self.server._handle_client(reader, writer))
+        self.assertEqual(len(writer.written), 1)
+        self.assertIn("reset by peer", "\n".join(logs.output))
+
+    def test_snapshot(self):
+        self.server._broadcast(STATE_ON)
+        self.server._broadcast(STATE_OFF_34)
+        self.assertEqual(
+            self.request(self.client, command="snapshot"),
+            {"type": "snapshot", "states": {"33": "on", "34": "off"}})
+
+    def test_task_from_request(self):
+        self.assertEqual(
+            task_from_request({"command": "lower", "target": "40"}).command,
+            b"@w940")
+        with self.assertRaises(ValueError):
+            task_from_request({"command": "status", "target": "333"})
@@ -0,0 +1,267 @@
+# Test the Reactor with the simulated SCSGate
+
+import logging
+import unittest
+import os
+import sys
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate.confirm import CommandVerifier  # NOQA E402
+from scsgate.health import HealthMonitor, PingTask  # NOQA E402
+from scsgate.pacing import CommandPacer  # NOQA E402
+from scsgate.reactor import _StatusRefresh  # NOQA E402
+from scsgate.simulation import Simulation  # NOQA E402
+from scsgate.tasks import BasicTask, ToggleStatusTask  # NOQA E402
+
+
+class TimestampTask(BasicTask):
+    """ Records when it is executed, does not use the bus """
+
+    cost = 0
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.executed_at = None
+
+    def execute(self, connection):
+        self.executed_at = self.clock()
+
+
+class TestSimulation(unittest.TestCase):
+    """ Test the Reactor against the simulated SCSGate """
+
+    def setUp(self):
+        logging.getLogger("scsgate.reactor").setLevel(logging.CRITICAL)
+
+    def run_scenario(self):
+        sim = Simulation()
+        reactor = sim.reactor()
+        for index in range(20):
+            sim.inject_at(0.01 * index, b"A8B833120198A3")
+        sim.at(0.05, lambda: reactor.append_task(
+            ToggleStatusTask(target="34", toggled=True)))
+        latency = sim.run(reactor, until=1.0)
+        return sim, latency
+
+    def test_deterministic(self):
+        first, first_latency = self.run_scenario()
+        second, second_latency = self.run_scenario()
+        self.assertEqual(first.serial.log, second.serial.log)
+        self.assertEqual(first_latency, second_latency)
+
+    def test_echo_and_stop_latency(self):
+        sim, latency = self.run_scenario()
+        states = [(message.entity, message.status)
+                  for _, message in sim.messages]
+        self.assertIn(("34", "on"), states)
+        # the loop notices stop() at the end of the current poll
+        self.assertLess(latency, 0.01)
+
+    def test_commands_not_starved_by_monitoring(self):
+        sim = Simulation()
+        reactor = sim.reactor()
+        for index in range(1000):
+            sim.inject_at(0, b"A8B833120198A3")
+        sim.at(0.1, lambda: reactor.append_task(
+            ToggleStatusTask(target="34", toggled=True)))
+        sim.run(reactor, until=0.5)
+
+        sent = [when for when, data in sim.serial.log if data == b"@w034"]
+        self.assertEqual(len(sent), 1)
+        self.assertLess(sent[0] - 0.1, 0.01)
+
+    def test_stalled_gateway(self):
+        sim = Simulation(read_timeout=2.0)
+        reactor = sim.reactor()
+        sim.at(0.1, lambda: sim.serial.stall(10))
+        latency = sim.run(reactor, until=0.5)
+        # the pending read is cancelled, it does not wait for its deadline
+        self.assertLessEqual(latency, sim.serial._timeout)
+
+    def queue_and_stop(self, **stop_options):
+        sim = Simulation()
+        reactor = sim.reactor()
+
+        def stop():
+            for target in ("31", "32", "33"):
+                reactor.append_task(
+                    ToggleStatusTask(target=target, toggled=True))
+            reactor.stop(**stop_options)
+
+        sim.inject_at(0, b"A8B833120198A3")
+        sim.at(0.1, stop)
+        reactor.run()
+        return sim, reactor.shutdown_report
+
+    def test_stop_drops_queued_tasks(self):
+        sim, report = self.queue_and_stop()
+        self.assertTrue(report.finished)
+        self.assertEqual(
+            [task.target for task in report.dropped], ["31", "32", "33"])
+        self.assertEqual(report.executed, [])
+        self.assertNotIn(b"@w031", [data for _, data in sim.serial.log])
+
+    def test_stop_drains_queued_tasks(self):
+        sim, report = self.queue_and_stop(drain=True)
+        self.assertEqual(
+            [task.target for task in report.executed], ["31", "32", "33"])
+        self.assertEqual(report.failed, [])
+        self.assertEqual(report.dropped, [])
+        written = [data for _, data in sim.serial.log]
+        self.assertEqual(written[-3:], [b"@w031", b"@w032", b"@w033"])
+
+    def test_drain_after_interrupted_read(self):
+        sim = Simulation()
+        reactor = sim.reactor()
+        sim.at(0.1, lambda: sim.serial.stall(0.01))
+        sim.at(0.105, lambda: reactor.append_task(
+            ToggleStatusTask(target="31", toggled=True)))
+        latency = sim.run(reactor, until=0.105, drain=True)
+
+        report = reactor.shutdown_report
+        self.assertEqual(len(report.executed), 1)
+        written = [data for _, data in sim.serial.log]
+        # the interrupted poll is cancelled before draining
+        self.assertEqual(written[-3:], [b"@r", b"@c", b"@w031"])
+        self.assertEqual(latency, report.elapsed)
+
+    def test_drain_bounded_by_deadline(self):
+        sim, report = self.queue_and_stop(drain=True, timeout=0.0015)
+        self.assertTrue(report.finished)
+        self.assertLess(len(report.executed), 3)
+        self.assertEqual(
+            len(report.executed) + len(report.dropped), 3)
+
+    def test_late_ack_does_not_kill_the_reactor(self):
+        sim = Simulation(read_timeout=1.0)
+        reactor = sim.reactor()
+
+        def stall_during_command():
+            reactor.append_task(ToggleStatusTask(target="31", toggled=True))
+            sim.serial.stall(1.5)
+        sim.at(0.1, stall_during_command)
+        sim.inject_at(2.0, b"A8B833120198A3")
+        sim.at(2.1, lambda: reactor.append_task(
+            ToggleStatusTask(target="34", toggled=True)))
+        sim.run(reactor, until=3.0)
+
+        written = [data for _, data in sim.serial.log]
+        self.assertIn(b"@c", written)
+        states = [(message.entity, message.status)
+                  for _, message in sim.messages]
+        self.assertIn(("33", "off"), states)
+        self.assertIn(("34", "on"), states)
+
+    def test_io_error_while_resynchronizing(self):
+        sim = Simulation(read_timeout=0.2)
+        reconnections = []
+        write = sim.serial.write
+
+        def unplugged(data):
+            if data == b"@c" and not reconnections:
+                raise OSError("unplugged")
+            return write(data)
+
+        def reconnect():
+            reconnections.append(sim.clock())
+            return sim.connection
+
+        sim.serial.write = unplugged
+        reactor = sim.reactor(connection_factory=reconnect, backoff_initial=0)
+        # the poll times out, then the resynchronization fails
+        sim.at(0.1, lambda: sim.serial.stall(0.5))
+        sim.inject_at(1.0, b"A8B833120198A3")
+        sim.run(reactor, until=2.0)
+
+        self.assertEqual(len(reconnections), 1)
+        self.assertIn(("33", "off"), [(message.entity, message.status)
+                                      for _, message in sim.messages])
+
+    def test_poll_timeouts_do_not_slow_down_the_pacer(self):
+        sim = Simulation(read_timeout=0.2)
+        pacer = CommandPacer(rate=20.0)
+        reactor = sim.reactor(pacer=pacer)
+        sim.at(0.1, lambda: sim.serial.stall(1.0))
+        sim.run(reactor, until=2.0)
+        self.assertEqual(pacer.rate, 20.0)
+
+    def test_pacer_without_clock(self):
+        sim = Simulation()
+        # seeded by the first try_acquire, with the time of the reactor
+        reactor = sim.reactor(pacer=CommandPacer(rate=10.0))
+        sim.at(0.1, lambda: reactor.append_task(
+            ToggleStatusTask(target="34", toggled=True)))
+        sim.run(reactor, until=2.0)
+
+        self.assertIn(b"@w034", [data for _, data in sim.serial.log])
+        self.assertEqual(reactor.shutdown_report.dropped, [])
+
+    def test_health_on_the_simulation_clock(self):
+        sim = Simulation(write_latency=0.002, read_latency=0.003)
+        monitor = HealthMonitor(clock=sim.clock)
+        reactor = sim.reactor(health=monitor)
+        sim.at(0.1, lambda: reactor.append_task(PingTask(monitor)))
+        status = []
+        sim.at(1.0, lambda: status.append(monitor.status()))
+        sim.run(reactor, until=2.0)
+
+        self.assertTrue(status[0]["live"])
+        self.assertTrue(status[0]["ready"])
+        self.assertLess(status[0]["since_heartbeat"], 0.1)
+        self.assertAlmostEqual(status[0]["ping"]["p50"], 0.005)
+
+    def test_deadline_tasks_do_not_feed_the_pacer(self):
+        sim = Simulation()
+        pacer = CommandPacer(rate=10.0, increase_step=1.0, clock=sim.clock)
+        reactor = sim.reactor(pacer=pacer)
+        verifier = CommandVerifier(reactor, deadline=0.1)
+        results = []
+        sim.at(0.1, lambda: results.append(verifier.submit(
+            ToggleStatusTask(target="34", toggled=True))))
+        sim.run(reactor, until=0.5)
+
+        self.assertTrue(results[0].confirmed)
+        # one command acknowledged, the expired deadline is not counted
+        self.assertEqual(pacer.rate, 11.0)
+
+    def test_free_tasks_do_not_wait_behind_held_task(self):
+        sim = Simulation()
+        pacer = CommandPacer(rate=1.0, burst=1, min_rate=1.0)
+        reactor = sim.reactor(pacer=pacer)
+        deadline = TimestampTask(sim.clock)
+
+        def queue():
+            # the second command waits ~1 s for a token
+            reactor.append_task(ToggleStatusTask(target="33", toggled=True))
+            reactor.append_task(ToggleStatusTask(target="34", toggled=True))
+            reactor.schedule_task(deadline, 0.05)
+
+        sim.at(0.1, queue)
+        sim.run(reactor, until=2.0)
+        self.assertLess(deadline.executed_at, 0.2)
+        self.assertIn(b"@w034", [data for _, data in sim.serial.log])
+
+    def test_refresh_deadline_starts_when_sent(self):
+        sim = Simulation(write_latency=0.01, echo=False)
+        reactor = sim.reactor()
+        refresh = _StatusRefresh(
+            reactor, ["33", "34", "35"], window=2, timeout=0.1)
+
+        def queue():
+            # the status requests wait behind ~0.2 s of commands
+            for index in range(20):
+                reactor.append_task(ToggleStatusTask(
+                    target="4{:X}".format(index % 16), toggled=True))
+            refresh.start()
+
+        sim.at(0.0, queue)
+        sim.run(reactor, until=1.0)
+        refresh.close()
+
+        self.assertTrue(refresh.done)
+        results = refresh.results
+        self.assertEqual(sorted(results), ["33", "34", "35"])
+        self.assertTrue(all(results.values()))
@@ -0,0 +1,52 @@
+# Test the tasks
+
+import os
+import sys
+import unittest
+
+# inject local copy to avoid testing the installed version instead of the
+# development one
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from scsgate.tasks import (  # NOQA E402
+    GetStatusTask, HaltRollerShutterTask, SetStatusTask, ToggleStatusTask)
+
+
+class TestTasks(unittest.TestCase):
+    """ Test the value semantics of the tasks """
+
+    def test_commands(self):
+        self.assertEqual(
+            ToggleStatusTask(target="33", toggled=True).command, b"@w033")
+        self.assertEqual(
+            HaltRollerShutterTask(target="40").command, b"@wA40")
+        self.assertEqual(
+            GetStatusTask(target="33").command, b"@W7A83300150026A3")
+
+    def test_commands_are_shared(self):
+        first = ToggleStatusTask(target="33", toggled=True)
+        second = ToggleStatusTask(target="33", toggled=True)
+        self.assertIs(first.command, second.command)
+        self.assertIs(GetStatusTask(target="33").command,
+                      GetStatusTask(target="33").command)
+
+    def test_equality(self):
+        toggle = ToggleStatusTask(target="33", toggled=False)
+        self.assertEqual(toggle, ToggleStatusTask(target="33", toggled=False))
+        self.assertNotEqual(toggle, ToggleStatusTask(target="33",
+                                                     toggled=True))
+        # same bytes, different kind of task
+        self.assertNotEqual(toggle, SetStatusTask(target="33", action=1))
+        self.assertNotEqual(GetStatusTask(target="33"), toggle)
+        self.assertEqual(
+            len({toggle, ToggleStatusTask(target="33", toggled=False),
+                 GetStatusTask(target="33"), GetStatusTask(target="33")}),
+            2)
+
+    def test_description(self):
+        task = ToggleStatusTask(target="33", toggled=True)
+        self.assertEqual(str(task), "ToggleStatusTask: target 33 - toggled "
+                                    "True")
+        self.assertIs(str(task), str(task))
+        self.assertEqual(str(GetStatusTask(target="33")),
+                         "GetStatusTask: target 33")